@@ -207,7 +207,10 @@ class ProjectWizardForm(forms.ModelForm):
 class AdvancedWizardForm(forms.ModelForm):
     class Meta:
         model = Project
-        fields = ['learning_method', 'percentage_irr', 'num_users_irr', 'batch_size', 'classifier']
+        fields = ['learning_method', 'percentage_irr', 'num_users_irr', 'batch_size', 'classifier',
+                  'featurizer', 'feature_dtype', 'collapse_near_duplicates',
+                  'incremental_training', 'tune_hyperparameters', 'training_max_rows',
+                  'training_max_seconds', 'prediction_keep_last']
 
     use_active_learning = forms.BooleanField(initial=True, required=False)
     active_l_choices = copy.deepcopy(Project.ACTIVE_L_CHOICES)
@@ -228,6 +231,20 @@ class AdvancedWizardForm(forms.ModelForm):
         widget=RadioSelect(), choices=Project.CLASSIFIER_CHOICES,
         initial="logistic regression", required=False
     )
+    featurizer = forms.ChoiceField(
+        widget=RadioSelect(), choices=Project.FEATURIZER_CHOICES,
+        initial="tfidf", required=False
+    )
+    feature_dtype = forms.ChoiceField(
+        widget=RadioSelect(), choices=Project.FEATURE_DTYPE_CHOICES,
+        initial="float64", required=False
+    )
+    collapse_near_duplicates = forms.BooleanField(initial=False, required=False)
+    incremental_training = forms.BooleanField(initial=False, required=False)
+    tune_hyperparameters = forms.BooleanField(initial=False, required=False)
+    training_max_rows = forms.IntegerField(min_value=100, required=False)
+    training_max_seconds = forms.IntegerField(min_value=1, required=False)
+    prediction_keep_last = forms.IntegerField(min_value=1, initial=2, required=False)
 
     def clean(self):
         use_active_learning = self.cleaned_data.get("use_active_learning")
@@ -244,6 +261,11 @@ class AdvancedWizardForm(forms.ModelForm):
             self.cleaned_data['classifier'] = None
             self.cleaned_data['learning_method'] = 'random'
 
+        if not self.cleaned_data.get("featurizer"):
+            self.cleaned_data['featurizer'] = 'tfidf'
+        if not self.cleaned_data.get("feature_dtype"):
+            self.cleaned_data['feature_dtype'] = 'float64'
+
         if use_default_batch_size:
             self.cleaned_data['batch_size'] = 0
         if not use_irr:
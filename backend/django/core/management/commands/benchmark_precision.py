@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics import accuracy_score
+
+import numpy as np
+import pandas as pd
+
+from core.models import Project
+from core.utils.utils_model import (get_classifier, set_vectorizer_dtype, fit_classifier,
+                                    predict_classifier)
+
+TRAIN_FILE_PATH = './core/data/SemEval-2016-Task6/train-feminism.csv'
+TEST_FILE_PATH = './core/data/SemEval-2016-Task6/test-feminism.csv'
+
+
+def matrix_bytes(matrix):
+    """Number of bytes used by the arrays of a CSR matrix"""
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+class Command(BaseCommand):
+    help = 'Compares the memory and accuracy of float64 and float32 features on the SemEval data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--train',
+            default=TRAIN_FILE_PATH,
+            help="CSV file with Text and Label columns to train on"
+        )
+        parser.add_argument(
+            '--test',
+            default=TEST_FILE_PATH,
+            help="CSV file with Text and Label columns to test on"
+        )
+
+    def handle(self, *args, **options):
+        train = pd.read_csv(options['train'], encoding='latin-1')
+        test = pd.read_csv(options['test'], encoding='latin-1')
+
+        features = {}
+        for dtype in (np.float64, np.float32):
+            vectorizer = TfidfVectorizer(max_df=settings.TFIDF_MAX_DF, min_df=settings.TFIDF_MIN_DF,
+                                         stop_words='english')
+            train_matrix = vectorizer.fit_transform(train['Text']).astype(dtype)
+            set_vectorizer_dtype(vectorizer, dtype)
+            test_matrix = vectorizer.transform(test['Text'])
+            features[dtype] = (train_matrix, test_matrix)
+
+            self.stdout.write('{}: sparse matrix {} bytes, vectorizer output {}'.format(
+                np.dtype(dtype).name, matrix_bytes(train_matrix), test_matrix.dtype))
+
+        for classifier, name in Project.CLASSIFIER_CHOICES:
+            results = {}
+            for dtype, (train_matrix, test_matrix) in features.items():
+                clf = get_classifier(classifier)
+                if 'random_state' in clf.get_params():
+                    clf.set_params(random_state=0)
+                fit_classifier(clf, train_matrix, train['Label'].values)
+                results[dtype] = predict_classifier(clf, test_matrix)
+
+            classes = clf.classes_
+            accuracy = dict((dtype, accuracy_score(test['Label'], classes[probs.argmax(axis=1)]))
+                            for dtype, probs in results.items())
+            agreement = np.mean(results[np.float64].argmax(axis=1) == results[np.float32].argmax(axis=1))
+            self.stdout.write('{:<28} accuracy float64 {:.4f} float32 {:.4f}  same prediction {:.2%}  max probability difference {:.2e}'.format(
+                name, accuracy[np.float64], accuracy[np.float32], agreement,
+                np.abs(results[np.float64] - results[np.float32]).max()))
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+import time
+import numpy as np
+
+from core.utils.utils_model import fit_tfidf_parallel
+
+
+def synthetic_corpus(num_docs, vocab_size=50000, min_words=5, max_words=40, seed=0):
+    """Generate random documents whose word frequencies follow a Zipf distribution,
+        like natural text
+
+    Args:
+        num_docs: Number of documents
+        vocab_size: Number of distinct words
+        min_words: Minimum number of words in a document
+        max_words: Maximum number of words in a document
+        seed: Random seed
+    Returns:
+        corpus: List of text
+    """
+    rng = np.random.RandomState(seed)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    words = [''.join(rng.choice(letters, rng.randint(3, 10))) for _ in range(vocab_size)]
+
+    lengths = rng.randint(min_words, max_words + 1, num_docs)
+    word_ids = np.minimum(rng.zipf(1.2, lengths.sum()), vocab_size) - 1
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+
+    return [' '.join(words[i] for i in word_ids[start:end])
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+class Command(BaseCommand):
+    help = 'Times building the tf-idf matrix of a synthetic corpus with different numbers of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--docs',
+            type=int,
+            default=1000000,
+            help="Number of documents in the synthetic corpus"
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            nargs='+',
+            default=[1, 2, 4, 8],
+            help="Numbers of worker processes to time, 1 is the serial TfidfVectorizer"
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=settings.TFIDF_CHUNK_SIZE,
+            help="Number of documents given to a worker at a time"
+        )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        corpus = synthetic_corpus(options['docs'])
+        self.stdout.write('Generated {} documents in {:.1f}s'.format(len(corpus), time.time() - start))
+
+        chunk_size = options['chunk_size']
+        baseline = None
+        for workers in options['workers']:
+            start = time.time()
+            if workers > 1:
+                chunks = (corpus[i:i + chunk_size] for i in range(0, len(corpus), chunk_size))
+                matrix, vectorizer = fit_tfidf_parallel(chunks, workers)
+            else:
+                vectorizer = TfidfVectorizer(max_df=settings.TFIDF_MAX_DF, min_df=settings.TFIDF_MIN_DF,
+                                             stop_words='english')
+                matrix = vectorizer.fit_transform(corpus)
+            elapsed = time.time() - start
+
+            if baseline is None:
+                baseline = elapsed
+            self.stdout.write('workers={:<3} {:8.1f}s  speedup {:.2f}x  matrix {}x{}'.format(
+                workers, elapsed, baseline / elapsed, matrix.shape[0], matrix.shape[1]))
@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sklearn.externals.joblib import parallel_backend
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+import time
+import pandas as pd
+
+from core.models import Project
+from core.utils.utils_model import (get_classifier, get_parallel_backend, set_n_jobs,
+                                    fit_classifier, cross_validate_classifier)
+
+TRAIN_FILE_PATH = './core/data/SemEval-2016-Task6/train-feminism.csv'
+
+
+class Command(BaseCommand):
+    help = 'Times training and 5-fold cross validation of each classifier with different numbers of cores'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--train',
+            default=TRAIN_FILE_PATH,
+            help="CSV file with Text and Label columns to train on"
+        )
+        parser.add_argument(
+            '--n-jobs',
+            type=int,
+            nargs='+',
+            default=[1, 2, 4, 8],
+            help="Numbers of cores to time"
+        )
+        parser.add_argument(
+            '--backend',
+            default=get_parallel_backend(),
+            choices=['threading', 'multiprocessing'],
+            help="joblib backend, celery workers use threading"
+        )
+
+    def handle(self, *args, **options):
+        train = pd.read_csv(options['train'], encoding='latin-1')
+        vectorizer = TfidfVectorizer(max_df=settings.TFIDF_MAX_DF, min_df=settings.TFIDF_MIN_DF,
+                                     stop_words='english')
+        X = vectorizer.fit_transform(train['Text'])
+        Y = train['Label'].values
+        self.stdout.write('{} rows, {} features, {} backend'.format(X.shape[0], X.shape[1], options['backend']))
+
+        for classifier, name in Project.CLASSIFIER_CHOICES:
+            baseline = None
+            for n_jobs in options['n_jobs']:
+                with parallel_backend(options['backend']):
+                    start = time.time()
+                    clf = get_classifier(classifier, n_jobs=n_jobs)
+                    fit_classifier(clf, X, Y)
+                    fit_time = time.time() - start
+
+                    start = time.time()
+                    set_n_jobs(clf, 1)
+                    cross_validate_classifier(clf, X, Y, n_jobs)
+                    cv_time = time.time() - start
+
+                if baseline is None:
+                    baseline = fit_time + cv_time
+                self.stdout.write('{:<28} n_jobs={:<3} fit {:7.2f}s  cv {:7.2f}s  speedup {:.2f}x'.format(
+                    name, n_jobs, fit_time, cv_time, baseline / (fit_time + cv_time)))
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0051_adminprogress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='featurizer',
+            field=models.CharField(choices=[('tfidf', 'TF-IDF (default)'), ('hashing', 'Hashed TF-IDF (recommended for very large datasets)')], default='tfidf', max_length=7),
+        ),
+    ]
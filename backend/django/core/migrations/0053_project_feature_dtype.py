@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0052_project_featurizer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='feature_dtype',
+            field=models.CharField(choices=[('float64', 'Double precision (default)'), ('float32', 'Single precision (uses half the memory)')], default='float64', max_length=7),
+        ),
+    ]
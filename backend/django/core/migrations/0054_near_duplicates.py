@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0053_project_feature_dtype'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='collapse_near_duplicates',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='representative',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='near_duplicates', to='core.Data'),
+        ),
+        migrations.CreateModel(
+            name='NearDuplicateBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField()),
+                ('data', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Data')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Project')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='nearduplicatebucket',
+            index_together=set([('project', 'bucket')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0054_near_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='incremental_training',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='model',
+            name='feature_version',
+            field=models.CharField(max_length=32, null=True),
+        ),
+    ]
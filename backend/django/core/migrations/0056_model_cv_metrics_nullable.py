@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0055_incremental_training'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='model',
+            name='cv_accuracy',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='model',
+            name='cv_metrics',
+            field=django.contrib.postgres.fields.jsonb.JSONField(null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0056_model_cv_metrics_nullable'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='project',
+            name='classifier',
+            field=models.CharField(choices=[('logistic regression', 'Logistic Regression (default)'), ('svm', 'Support Vector Machine (warning: slower for large datasets)'), ('linear svm', 'Linear Support Vector Machine (fast for large datasets)'), ('random forest', 'Random Forest'), ('gnb', 'Gaussian Naive Bayes')], default='logistic regression', max_length=19, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0057_linear_svm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='model',
+            name='run_stats',
+            field=django.contrib.postgres.fields.jsonb.JSONField(null=True),
+        ),
+    ]
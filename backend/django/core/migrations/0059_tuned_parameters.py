@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0058_model_run_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='tune_hyperparameters',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='TunedParameters',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estimator', models.CharField(max_length=50)),
+                ('feature_version', models.CharField(max_length=32)),
+                ('parameters', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('score', models.FloatField()),
+                ('num_labels', models.IntegerField()),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Project')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='tunedparameters',
+            unique_together=set([('project', 'estimator', 'feature_version')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0059_tuned_parameters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='training_max_rows',
+            field=models.PositiveIntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='training_max_seconds',
+            field=models.PositiveIntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='model',
+            name='training_strategy',
+            field=models.CharField(choices=[('full', 'Fit on all labeled data'), ('incremental', 'Updated from the previous model'), ('subsample', 'Fit on a stratified sample of the labeled data')], default='full', max_length=11),
+        ),
+        migrations.AddField(
+            model_name='model',
+            name='training_rows',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0060_training_budget'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='model',
+            name='label_order',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), null=True, size=None),
+        ),
+        migrations.CreateModel(
+            name='DataPredictionSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('probabilities', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None)),
+                ('max_probability', models.FloatField()),
+                ('least_confident', models.FloatField()),
+                ('margin_sampling', models.FloatField()),
+                ('entropy', models.FloatField()),
+                ('data', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Data')),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Model')),
+                ('predicted_label', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Label')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='datapredictionsummary',
+            unique_together=set([('data', 'model')]),
+        ),
+    ]
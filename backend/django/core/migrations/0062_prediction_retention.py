@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0061_data_prediction_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='prediction_keep_last',
+            field=models.PositiveIntegerField(default=2, null=True, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
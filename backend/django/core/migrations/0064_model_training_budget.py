@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0063_model_last_label_pk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='model',
+            name='training_budget',
+            field=models.IntegerField(null=True),
+        ),
+    ]
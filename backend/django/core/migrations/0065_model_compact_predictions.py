@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0064_model_training_budget'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='model',
+            name='compact_predictions',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0065_model_compact_predictions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NearDuplicateSignature',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signature', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('data', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='core.Data')),
+            ],
+        ),
+    ]
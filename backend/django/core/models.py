@@ -4,7 +4,7 @@ from django.utils import timezone
 from django.urls import reverse
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.fields import JSONField, ArrayField
 from django.core.validators import MaxValueValidator, MinValueValidator
 
 
@@ -51,14 +51,40 @@ class Project(models.Model):
     CLASSIFIER_CHOICES = [
         ("logistic regression", "Logistic Regression (default)"),
         ("svm", "Support Vector Machine (warning: slower for large datasets)"),
+        ("linear svm", "Linear Support Vector Machine (fast for large datasets)"),
         ("random forest", "Random Forest"),
         ("gnb", "Gaussian Naive Bayes")
     ]
 
+    FEATURIZER_CHOICES = [
+        ("tfidf", "TF-IDF (default)"),
+        ("hashing", "Hashed TF-IDF (recommended for very large datasets)")
+    ]
+
+    FEATURE_DTYPE_CHOICES = [
+        ("float64", "Double precision (default)"),
+        ("float32", "Single precision (uses half the memory)")
+    ]
+
     learning_method = models.CharField(
         max_length=15, default='least confident', choices=ACTIVE_L_CHOICES)
     classifier = models.CharField(
         max_length=19, default="logistic regression", choices=CLASSIFIER_CHOICES, null=True)
+    featurizer = models.CharField(
+        max_length=7, default="tfidf", choices=FEATURIZER_CHOICES)
+    feature_dtype = models.CharField(
+        max_length=7, default="float64", choices=FEATURE_DTYPE_CHOICES)
+    collapse_near_duplicates = models.BooleanField(default=False)
+    incremental_training = models.BooleanField(default=False)
+    tune_hyperparameters = models.BooleanField(default=False)
+    # Training budget, larger labeled sets are subsampled to stay within it.
+    # None is no limit
+    training_max_rows = models.PositiveIntegerField(null=True, default=None)
+    training_max_seconds = models.PositiveIntegerField(null=True, default=None)
+    # The predictions and uncertainties of all but this many newest models are
+    # deleted in the background.  None keeps them all
+    prediction_keep_last = models.PositiveIntegerField(
+        null=True, default=2, validators=[MinValueValidator(1)])
 
     def get_absolute_url(self):
         return reverse('projects:project_detail', kwargs={'pk': self.pk})
@@ -98,16 +124,59 @@ class ProjectPermissions(models.Model):
 
 
 class Model(models.Model):
+    TRAINING_STRATEGY_CHOICES = [
+        ("full", "Fit on all labeled data"),
+        ("incremental", "Updated from the previous model"),
+        ("subsample", "Fit on a stratified sample of the labeled data")
+    ]
+
     pickle_path = models.TextField()
     project = models.ForeignKey('Project')
     training_set = models.ForeignKey('TrainingSet')
-    cv_accuracy = models.FloatField()
-    cv_metrics = JSONField()
+    # Set by compute_cv_metrics after the model is trained
+    cv_accuracy = models.FloatField(null=True)
+    cv_metrics = JSONField(null=True)
+    # Changes whenever the tf-idf features are refit, so incremental training
+    # only continues from a model trained on the same features
+    feature_version = models.CharField(max_length=32, null=True)
+    # The time, rows and peak memory of each stage of the run which trained,
+    # predicted with and cross validated the model
+    run_stats = JSONField(null=True)
+    training_strategy = models.CharField(
+        max_length=11, default="full", choices=TRAINING_STRATEGY_CHOICES)
+    # Number of labeled data the model was fit on
+    training_rows = models.IntegerField(null=True)
+    # The row budget a subsampled model drew its sample with
+    training_budget = models.IntegerField(null=True)
+    # The largest DataLabel pk the model was fit on.  Incremental training
+    # continues from the labels after it
+    last_label_pk = models.IntegerField(null=True)
+    # The Label pks in the order of the predicted probabilities of the model
+    label_order = ArrayField(models.IntegerField(), null=True)
+    # Whether the predictions of the model were saved as DataPredictionSummary
+    # rows rather than DataPrediction and DataUncertainty rows.  Set when the
+    # model predicts, so flipping COMPACT_PREDICTIONS only affects later models
+    compact_predictions = models.BooleanField(default=False)
+    # Only holds the predictions of models without compact_predictions
     predictions = models.ManyToManyField(
         'Data', related_name='models', through='DataPrediction'
     )
 
 
+class TunedParameters(models.Model):
+    class Meta:
+        unique_together = (('project', 'estimator', 'feature_version'))
+    # The best parameters found by the hyperparameter search for a classifier,
+    # reused until the tf-idf features are refit
+    project = models.ForeignKey('Project')
+    estimator = models.CharField(max_length=50)
+    feature_version = models.CharField(max_length=32)
+    parameters = JSONField()
+    score = models.FloatField()
+    num_labels = models.IntegerField()
+    timestamp = models.DateTimeField(default=timezone.now)
+
+
 class Data(models.Model):
     class Meta:
         unique_together = (('hash', 'upload_id_hash', 'project'))
@@ -117,11 +186,29 @@ class Data(models.Model):
     irr_ind = models.BooleanField(default=False)
     upload_id = models.CharField(max_length=128)
     upload_id_hash = models.CharField(max_length=128)
+    # Set on near duplicates to the datum that stands in for them
+    representative = models.ForeignKey('self', null=True, related_name='near_duplicates',
+                                       on_delete=models.SET_NULL)
 
     def __str__(self):
         return self.text
 
 
+class NearDuplicateBucket(models.Model):
+    class Meta:
+        index_together = (('project', 'bucket'))
+    project = models.ForeignKey('Project')
+    bucket = models.BigIntegerField()
+    data = models.ForeignKey('Data')
+
+
+class NearDuplicateSignature(models.Model):
+    # The MinHash signature of a representative, so later uploads are compared
+    # against it without hashing its text again
+    data = models.OneToOneField('Data')
+    signature = ArrayField(models.IntegerField())
+
+
 class Label(models.Model):
     class Meta:
         unique_together = (('name', 'project'))
@@ -181,6 +268,22 @@ class DataUncertainty(models.Model):
     entropy = models.FloatField()
 
 
+class DataPredictionSummary(models.Model):
+    class Meta:
+        unique_together = (('data', 'model'))
+    # The predictions of a model with compact_predictions, one row per datum in
+    # place of a DataPrediction per label and a DataUncertainty
+    data = models.ForeignKey('Data')
+    model = models.ForeignKey('Model')
+    # The probability of each label, in the order of model.label_order
+    probabilities = ArrayField(models.FloatField())
+    predicted_label = models.ForeignKey('Label')
+    max_probability = models.FloatField()
+    least_confident = models.FloatField()
+    margin_sampling = models.FloatField()
+    entropy = models.FloatField()
+
+
 class Queue(models.Model):
     profile = models.ForeignKey('Profile', blank=True, null=True)
     project = models.ForeignKey('Project')
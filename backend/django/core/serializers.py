@@ -27,7 +27,9 @@ class ProjectSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Project
-        fields = ('name', 'labels', 'learning_method', 'classifier')
+        fields = ('name', 'labels', 'learning_method', 'classifier', 'featurizer', 'feature_dtype',
+                  'collapse_near_duplicates', 'incremental_training', 'tune_hyperparameters',
+                  'training_max_rows', 'training_max_seconds', 'prediction_keep_last')
 
 
 class CoreModelSerializer(serializers.HyperlinkedModelSerializer):
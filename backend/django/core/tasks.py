@@ -13,6 +13,7 @@ def send_model_task(project_pk):
     from core.models import Project, TrainingSet
     from core.utils.utils_model import train_and_save_model, predict_data
     from core.utils.utils_queue import fill_queue, find_queue_length
+    from core.utils.utils_stats import new_run_stats, record_stage
 
     project = Project.objects.get(pk=project_pk)
     queue = project.queue_set.get(type="normal")
@@ -20,9 +21,10 @@ def send_model_task(project_pk):
     al_method = project.learning_method
     batch_size = project.batch_size
 
-    model = train_and_save_model(project)
+    stats = new_run_stats()
+    model = train_and_save_model(project, stats)
     if al_method != 'random':
-        predict_data(project, model)
+        predict_data(project, model, stats)
     TrainingSet.objects.create(project=project, set_number=project.get_current_training_set().set_number + 1)
 
     # Determine if queue size has changed (num_coders changed) and re-fill queue
@@ -32,18 +34,89 @@ def send_model_task(project_pk):
         queue.length = q_length
         queue.save()
 
-    fill_queue(queue, irr_queue=irr_queue, orderby=al_method,
-               irr_percent=project.percentage_irr, batch_size=batch_size)
+    with record_stage(stats, 'fill_queue') as stage:
+        stage['rows'] = fill_queue(queue, irr_queue=irr_queue, orderby=al_method,
+                                   irr_percent=project.percentage_irr, batch_size=batch_size)
+    model.run_stats = stats
+    model.save(update_fields=['run_stats'])
+
+    # Cross validation is not needed to predict or fill the queue, so it runs
+    # after the coders have new data
+    send_cv_metrics_task.delay(model.pk)
+    if project.tune_hyperparameters:
+        send_tuning_task.delay(project_pk)
+    send_prediction_retention_task.delay(project_pk)
+
+
+@shared_task
+def send_cv_metrics_task(model_pk):
+    """Cross validate a trained model and save its metrics"""
+    from core.models import Model
+    from core.utils.utils_model import compute_cv_metrics
+
+    compute_cv_metrics(Model.objects.get(pk=model_pk))
+
+
+@shared_task
+def send_tuning_task(project_pk):
+    """Search for better classifier parameters for a project, unless they were
+    already found for its current features"""
+    from core.models import Project
+    from core.utils.utils_model import tune_hyperparameters
+
+    tune_hyperparameters(Project.objects.get(pk=project_pk))
+
+
+@shared_task
+def send_prediction_retention_task(project_pk):
+    """Delete the predictions and uncertainties of the models of a project which
+    are older than its retention policy keeps"""
+    from core.models import Project
+    from core.utils.utils_model import prune_predictions
+
+    return prune_predictions(Project.objects.get(pk=project_pk))
+
+
+@shared_task
+def send_near_duplicate_task(project_pk):
+    """Collapse the near duplicates among the data of a project which were not
+    compared yet.  The queues skip those data until this task has run"""
+    from core.models import Project
+    from core.utils.utils_near_duplicates import collapse_near_duplicates
+
+    project = Project.objects.get(pk=project_pk)
+    return collapse_near_duplicates(project)
 
 
 @shared_task
 def send_tfidf_creation_task(project_pk):
-    """Create and Save tfidf"""
-    from core.utils.utils_model import create_tfidf_matrix, save_tfidf_matrix, save_tfidf_vectorizer
+    """Create and Save tfidf.  If the project already has a tfidf matrix only the
+    newly uploaded data is added to it, unless the matrix needs to be rebuilt.
+    Nothing is done if the matrix was built from the same data and settings"""
+    from core.models import Project
+    from core.utils.utils_model import (create_tfidf_matrix, update_tfidf_matrix,
+                                        update_hashing_matrix, get_hashing_pipeline,
+                                        save_tfidf_matrix, save_tfidf_vectorizer,
+                                        get_corpus_fingerprint, load_tfidf_meta,
+                                        get_tfidf_path)
+
+    project = Project.objects.get(pk=project_pk)
+    fingerprint = get_corpus_fingerprint(project_pk, project.featurizer, project.feature_dtype)
+    if load_tfidf_meta(project_pk).get('fingerprint') == fingerprint:
+        return get_tfidf_path(project_pk)
 
-    tf_idf, vectorizer = create_tfidf_matrix(project_pk)
+    if project.featurizer == 'hashing':
+        tf_idf = update_hashing_matrix(project_pk, dtype=project.feature_dtype)
+        save_tfidf_vectorizer(get_hashing_pipeline(tf_idf), project_pk)
+    else:
+        tf_idf = update_tfidf_matrix(project_pk, dtype=project.feature_dtype)
+        if tf_idf is None:
+            tf_idf, vectorizer = create_tfidf_matrix(project_pk, dtype=project.feature_dtype)
+            save_tfidf_vectorizer(vectorizer, project_pk)
+    # The vectorizer is saved first so a matrix with this fingerprint always has
+    # a matching vectorizer
+    tf_idf['meta'] = dict(tf_idf['meta'], fingerprint=fingerprint)
     file = save_tfidf_matrix(tf_idf, project_pk)
-    save_tfidf_vectorizer(vectorizer, project_pk)
 
     return file
 
@@ -41,6 +41,7 @@ adminpage_patterns = [
     url(r'^label_distribution/(?P<project_pk>\d+)/$', api_admin.label_distribution),
     url(r'^label_timing/(?P<project_pk>\d+)/$', api_admin.label_timing),
     url(r'^model_metrics/(?P<project_pk>\d+)/$', api_admin.model_metrics),
+    url(r'^model_run_stats/(?P<project_pk>\d+)/$', api_admin.model_run_stats),
     url(r'^data_coded_table/(?P<project_pk>\d+)/$', api_admin.data_coded_table),
     url(r'^data_predicted_table/(?P<project_pk>\d+)/$', api_admin.data_predicted_table),
     url(r'^get_irr_metrics/(?P<project_pk>\d+)/$', api_admin.get_irr_metrics),
@@ -7,13 +7,14 @@ import os
 import numpy as np
 import hashlib
 import pandas as pd
-from itertools import combinations
+from itertools import combinations, islice
 from io import StringIO
-from celery import chord
+from celery import chain
 
 from core.models import (Project, Data, Profile, Label,
                          DataLabel, TrainingSet, IRRLog, ProjectPermissions)
 from core.utils.utils_queue import fill_queue
+from core.utils.utils_near_duplicates import collapse_near_duplicates
 from core import tasks
 
 # https://stackoverflow.com/questions/20625582/how-to-deal-with-settingwithcopywarning-in-pandas
@@ -45,18 +46,23 @@ def create_profile(username, password, email):
     return Profile.objects.get(user=user)
 
 
-def create_project(name, creator, percentage_irr=10, num_users_irr=2, classifier=None):
+def create_project(name, creator, percentage_irr=10, num_users_irr=2, classifier=None,
+                   featurizer='tfidf', feature_dtype='float64', collapse_near_duplicates=False):
     '''
     Create a project with the given name and creator.
     '''
     if classifier:
         proj = Project.objects.create(name=name, creator=creator,
                                       percentage_irr=percentage_irr,
-                                      num_users_irr=num_users_irr, classifier=classifier)
+                                      num_users_irr=num_users_irr, classifier=classifier,
+                                      featurizer=featurizer, feature_dtype=feature_dtype,
+                                      collapse_near_duplicates=collapse_near_duplicates)
     else:
         proj = Project.objects.create(name=name, creator=creator,
                                       percentage_irr=percentage_irr,
-                                      num_users_irr=num_users_irr)
+                                      num_users_irr=num_users_irr, featurizer=featurizer,
+                                      feature_dtype=feature_dtype,
+                                      collapse_near_duplicates=collapse_near_duplicates)
     TrainingSet.objects.create(project=proj, set_number=0)
 
     return proj
@@ -66,31 +72,39 @@ def upload_data(form_data, project, queue=None, irr_queue=None, batch_size=30):
     """Perform data upload given validated form_data.
 
     1. Add data to database
-    2. If new project then fill queue (only new project will pass queue object)
+    2. If new project then collapse near duplicates and fill queue (only new
+       project will pass queue object)
     3. Save the uploaded data file
-    4. Create tf_idf file
-    5. Check and Trigger model
+    4. Collapse near duplicates of an existing project
+    5. Create tf_idf file
+    6. Check and Trigger model
     """
     new_df = add_data(project, form_data)
     if queue:
+        # The first queue is filled before the wizard redirects to the project,
+        # so its near duplicates are collapsed here rather than in the task chain
+        if project.collapse_near_duplicates:
+            collapse_near_duplicates(project)
         fill_queue(queue=queue, irr_queue=irr_queue, orderby='random',
                    irr_percent=project.percentage_irr, batch_size=batch_size)
 
     # Since User can upload Labeled Data and this data is added to current training_set
     # we need to check_and_trigger model.  However since training model requires
-    # tf_idf to be created we must create a chord which garuntees that tfidf
-    # creation task is completed before check and trigger model task
+    # tf_idf to be created we must create a chain which garuntees that tfidf
+    # creation task is completed before check and trigger model task.  Near
+    # duplicates are collapsed first, since only their representatives are featurized.
+    # Until then fill_queue skips the uploaded data, so no duplicates are queued
 
     if len(new_df) > 0:
         save_data_file(new_df, project.pk)
+        workflow = []
+        if project.collapse_near_duplicates and not queue:
+            workflow.append(tasks.send_near_duplicate_task.si(project.pk))
         if project.classifier is not None:
-            transaction.on_commit(
-                lambda:
-                    chord(
-                        tasks.send_tfidf_creation_task.s(project.pk),
-                        tasks.send_check_and_trigger_model_task.si(project.pk)
-                    ).apply_async()
-            )
+            workflow += [tasks.send_tfidf_creation_task.si(project.pk),
+                         tasks.send_check_and_trigger_model_task.si(project.pk)]
+        if len(workflow) > 0:
+            transaction.on_commit(lambda: chain(*workflow).apply_async())
 
 
 def create_data_from_csv(df, project):
@@ -118,6 +132,33 @@ def create_data_from_csv(df, project):
                     columns=['text', 'project_id', 'hash', 'upload_id', 'upload_id_hash', 'irr_ind'])
 
 
+def copy_rows(model_class, columns, rows, chunk_size=None):
+    '''
+    Insert rows into the table of a model using cursor.copy_from, writing an
+    in-memory tsv of chunk_size rows at a time so memory stays flat however many
+    rows there are.  Each row is a tuple of numbers in the order of columns.
+    Returns the number of rows inserted.
+    '''
+    if chunk_size is None:
+        chunk_size = settings.COPY_CHUNK_SIZE
+    rows = iter(rows)
+    num_rows = 0
+
+    with connection.cursor() as c:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            stream = StringIO()
+            for row in chunk:
+                stream.write('\t'.join(str(value) for value in row) + '\n')
+            stream.seek(0)
+            c.copy_from(stream, model_class._meta.db_table, sep='\t', null='', columns=columns)
+            num_rows += len(chunk)
+
+    return num_rows
+
+
 def create_labels_from_csv(df, project):
     '''
     Insert DataLabel objects into database using cursor.copy_from by creating an in-memory
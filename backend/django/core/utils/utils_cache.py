@@ -0,0 +1,138 @@
+from django.conf import settings
+from scipy import sparse
+
+import sys
+import mmap
+import threading
+import numpy as np
+from collections import OrderedDict
+
+# The artifacts loaded by this process, least recently used first.  Each key is
+# (kind, project pk) and holds only the newest version seen of that artifact
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def estimate_size(obj, seen=None):
+    """Estimate the memory held by an artifact from the numpy arrays in it.
+        Memory mapped arrays are not counted, their pages are shared by every
+        process through the OS page cache.
+
+    Args:
+        obj: The artifact, a classifier, vectorizer or tf-idf dict
+        seen: dict of the objects already counted by id
+    Returns:
+        size: Number of bytes
+    """
+    if seen is None:
+        seen = {}
+    if id(obj) in seen:
+        return 0
+    # keep a reference so the id is not reused by a temporary state dict
+    seen[id(obj)] = obj
+
+    if isinstance(obj, np.ndarray):
+        if is_memory_mapped(obj):
+            return 0
+        return obj.nbytes if obj.dtype != object else sum(estimate_size(x, seen) for x in obj.flat)
+    if sparse.issparse(obj):
+        return sum(estimate_size(getattr(obj, name), seen) for name in ('data', 'indices', 'indptr', 'row', 'col')
+                   if hasattr(obj, name))
+    if isinstance(obj, (str, bytes)):
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        # ex: the vocabulary of a TfidfVectorizer
+        return sys.getsizeof(obj) + sum(estimate_size(key, seen) + estimate_size(value, seen)
+                                        for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(estimate_size(value, seen) for value in obj)
+    # estimators, and the cython trees of random forests, expose their arrays
+    # through the state they are pickled with
+    if hasattr(obj, '__getstate__'):
+        try:
+            return estimate_size(obj.__getstate__(), seen)
+        except TypeError:
+            return 0
+    if hasattr(obj, '__dict__'):
+        return estimate_size(vars(obj), seen)
+    return 0
+
+
+def is_memory_mapped(array):
+    """Check if an array, or the array it is a view of, is memory mapped
+
+    Args:
+        array: numpy array
+    Returns:
+        Boolean
+    """
+    base = array
+    while isinstance(base, np.ndarray):
+        if isinstance(base, np.memmap):
+            return True
+        base = base.base
+    return isinstance(base, mmap.mmap)
+
+
+def get_cached(kind, project_pk, version, load):
+    """Get an artifact of a project from the cache of this worker process, loading
+        it if the cache does not hold this version of it.  Artifacts are shared
+        between callers and must not be modified.
+
+    Args:
+        kind: The kind of artifact, ex: 'model', 'tfidf', 'vectorizer'
+        project_pk: The pk of the project
+        version: Identifies the saved artifact, a different version is reloaded
+        load: Function which loads the artifact
+    Returns:
+        artifact: The loaded artifact
+    """
+    key = (kind, project_pk)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == version:
+            _cache.move_to_end(key)
+            return entry[1]
+
+    artifact = load()
+    put_cached(kind, project_pk, version, artifact)
+    return artifact
+
+
+def put_cached(kind, project_pk, version, artifact):
+    """Add an artifact to the cache of this worker process, replacing any other
+        version of it, then evict the least recently used artifacts until the
+        cache fits in ARTIFACT_CACHE_BYTES.  Artifacts larger than the whole cache
+        are not kept.
+
+    Args:
+        kind: The kind of artifact
+        project_pk: The pk of the project
+        version: Identifies the saved artifact
+        artifact: The loaded artifact
+    """
+    key = (kind, project_pk)
+    size = estimate_size(artifact)
+    with _cache_lock:
+        _cache.pop(key, None)
+        if size > settings.ARTIFACT_CACHE_BYTES:
+            return
+        _cache[key] = (version, artifact, size)
+        total = sum(entry[2] for entry in _cache.values())
+        while total > settings.ARTIFACT_CACHE_BYTES:
+            _, (_, _, evicted_size) = _cache.popitem(last=False)
+            total -= evicted_size
+
+
+def invalidate_cached(project_pk, kind=None):
+    """Drop the cached artifacts of a project from this worker process.  Other
+        processes notice the new version the next time they get the artifact.
+
+    Args:
+        project_pk: The pk of the project
+        kind: The kind of artifact to drop, or None for all of them
+    """
+    with _cache_lock:
+        for key in list(_cache):
+            if key[1] == project_pk and (kind is None or key[0] == kind):
+                del _cache[key]
@@ -1,25 +1,57 @@
 from django.conf import settings
-
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
-from sklearn.svm import SVC
+from django.utils import timezone
+from django.db.models import IntegerField, Max
+from django.db.models.functions import Coalesce
+
+from sklearn.feature_extraction.text import (TfidfVectorizer, HashingVectorizer, TfidfTransformer,
+                                             CountVectorizer)
+from sklearn.pipeline import make_pipeline
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.svm import SVC, LinearSVC
+from sklearn.calibration import CalibratedClassifierCV
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.naive_bayes import GaussianNB
-from sklearn.model_selection import cross_val_predict
+from sklearn.model_selection import cross_val_predict, StratifiedKFold, GridSearchCV
+from sklearn.base import clone
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
-from sklearn.externals import joblib
+from sklearn.externals.joblib import parallel_backend, Parallel, delayed
 from scipy import sparse
+from billiard import Pool
 import statsmodels.stats.inter_rater as raters
 import os
-import math
+import glob
+from itertools import islice, repeat
+from functools import partial
+import json
+import hashlib
+import uuid
+import shutil
+import numbers
+import multiprocessing
+import billiard
 import numpy as np
 import pandas as pd
 import pickle
 
-from core.models import (Data, Label, DataLabel, Model, DataPrediction,
-                         DataUncertainty, RecycleBin, IRRLog)
+from core.models import (Data, Label, DataLabel, Model, DataPrediction, TunedParameters,
+                         DataUncertainty, DataPredictionSummary, RecycleBin, IRRLog)
 from core import tasks
 from core.utils.utils_queue import handle_empty_queue, fill_queue
+from core.utils.util import copy_rows
+from core.utils.utils_redis import reserve_training_cores
+from core.utils.utils_registry import (save_model_artifact, load_model_artifact,
+                                       load_cached_model, prune_model_artifacts)
+from core.utils.utils_cache import get_cached, put_cached, invalidate_cached
+from core.utils.utils_stats import new_run_stats, record_stage
+
+# How fast the fit time of each classifier grows with the number of labeled
+# rows, fit time ~ rows ** exponent.  Classifiers not listed grow linearly
+FIT_TIME_EXPONENTS = {
+    'svm': 2.0,
+    'random forest': 1.2
+}
+# The most folds the probabilities of a linear svm are calibrated over
+CALIBRATION_FOLDS = 3
 
 
 def cohens_kappa(project):
@@ -138,15 +170,15 @@ def least_confident(probs):
         p is probability of highest probability class
 
     Args:
-        probs: List of predicted probabilites
+        probs: Array of predicted probabilites, or a 2d array with the
+            probabilities of one datum in each row
     Returns:
-        x
+        x, or an array of x for each row
     """
     if not isinstance(probs, np.ndarray):
         raise ValueError('Probs should be a numpy array')
 
-    max_prob = max(probs)
-    return 1 - max_prob
+    return 1 - probs.max(axis=-1)
 
 
 def margin_sampling(probs):
@@ -155,16 +187,17 @@ def margin_sampling(probs):
         p1 is probabiiity of highest probability class
         p2 is probability of lowest probability class
     Args:
-        probs: List of predicted probabilities
+        probs: Array of predicted probabilities, or a 2d array with the
+            probabilities of one datum in each row
     Returns:
-        x
+        x, or an array of x for each row
     """
     if not isinstance(probs, np.ndarray):
         raise ValueError('Probs should be a numpy array')
 
-    # https://stackoverflow.com/questions/26984414/efficiently-sorting-a-numpy-array-in-descending-order#answer-26984520
-    probs[::-1].sort()
-    return probs[0] - probs[1]
+    # the two highest probabilities end up last, without sorting probs in place
+    top = np.partition(probs, -2, axis=-1)
+    return top[..., -1] - top[..., -2]
 
 
 def entropy(probs):
@@ -172,20 +205,18 @@ def entropy(probs):
         x = -sum(p * log(p))
         the sum is sumation across p's
     Args:
-        probs: List of predicted probabilities
+        probs: Array of predicted probabilities, or a 2d array with the
+            probabilities of one datum in each row
     Returns:
-        x
+        x, or an array of x for each row
     """
     if not isinstance(probs, np.ndarray):
         raise ValueError('Probs should be a numpy array')
 
-    non_zero_probs = (p for p in probs if p > 0)
-
-    total = 0
-    for p in non_zero_probs:
-        total += p * math.log10(p)
-
-    return -total
+    # zero probabilities add nothing to the sum
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(probs > 0, probs * np.log10(probs), 0)
+    return -terms.sum(axis=-1)
 
 
 def check_and_trigger_model(datum, profile=None):
@@ -231,25 +262,91 @@ def check_and_trigger_model(datum, profile=None):
     return return_str
 
 
-def train_and_save_model(project):
-    """Given a project create a model, train it, and save the model pickle
+def get_classifier(classifier, incremental=False, n_jobs=1):
+    """Create an untrained classifier of the given type
+
+    Args:
+        classifier: One of the Project.CLASSIFIER_CHOICES
+        incremental: If True, return a classifier which can be updated with partial_fit
+        n_jobs: Number of cores the classifier may use
+    Returns:
+        clf: The scikit-learn classifier, or None if the type is not valid
+    """
+    if classifier == "logistic regression" and incremental:
+        # logistic regression fit by stochastic gradient descent.  partial_fit does
+        # not support class_weight='balanced', the balanced weights are passed as
+        # sample weights instead
+        return SGDClassifier(loss='log', max_iter=1000, tol=1e-3, n_jobs=n_jobs)
+    elif classifier == "logistic regression":
+        return LogisticRegression(class_weight='balanced', solver='lbfgs', multi_class='multinomial',
+                                  n_jobs=n_jobs)
+    elif classifier == "svm":
+        return SVC(probability=True)
+    elif classifier == "linear svm":
+        # A linear SVM has no probabilities, they are fit with a sigmoid on the
+        # decision function over three folds, which is much cheaper than the
+        # kernel SVM's internal five fold Platt scaling.  fit_classifier lowers the
+        # folds when a label has too few examples
+        return CalibratedClassifierCV(LinearSVC(class_weight='balanced'), method='sigmoid',
+                                      cv=CALIBRATION_FOLDS)
+    elif classifier == "random forest":
+        return RandomForestClassifier(n_jobs=n_jobs)
+    elif classifier == "gnb":
+        return GaussianNB()
+    else:
+        return None
+
+
+def get_parallel_backend():
+    """Get the joblib backend to run parallel training with.  Celery's prefork
+        workers run tasks in daemonic processes, which joblib's default backend
+        cannot start processes from, so it would quietly use a single job.  Threads
+        are used there instead, the heavy parts of scikit-learn release the GIL.
+
+    Returns:
+        backend: 'threading' or 'multiprocessing'
+    """
+    if multiprocessing.current_process().daemon or billiard.current_process().daemon:
+        return 'threading'
+    return 'multiprocessing'
+
+
+def set_n_jobs(clf, n_jobs):
+    """Set the number of cores a classifier uses, if it can use more than one
+
+    Args:
+        clf: The classifier
+        n_jobs: Number of cores
+    """
+    if 'n_jobs' in clf.get_params():
+        clf.set_params(n_jobs=n_jobs)
+
+
+def train_and_save_model(project, stats=None):
+    """Given a project create a model, train it, and save the model pickle.  The
+        cross validation metrics are computed afterwards by compute_cv_metrics
 
     Args:
         project: The project to start training
+        stats: The stats of the run to add the training stages to, a new run is
+            started if None
     Returns:
         model: A model object
     """
-    if project.classifier == "logistic regression":
-        clf = LogisticRegression(class_weight='balanced', solver='lbfgs', multi_class='multinomial')
-    elif project.classifier == "svm":
-        clf = SVC(probability=True)
-    elif project.classifier == "random forest":
-        clf = RandomForestClassifier()
-    elif project.classifier == "gnb":
-        clf = GaussianNB()
-    else:
+    if stats is None:
+        stats = new_run_stats()
+    incremental = project.incremental_training and project.classifier == "logistic regression"
+    clf = get_classifier(project.classifier, incremental)
+    if clf is None:
         raise ValueError('There was no valid classifier for project: ' + str(project.pk))
-    tf_idf = load_tfidf_matrix(project.pk)
+    with record_stage(stats, 'load_features') as stage:
+        tf_idf = load_cached_tfidf_matrix(project.pk)
+        stage['rows'] = tf_idf['matrix'].shape[0]
+
+    tuned = get_tuned_parameters(project, clf, tf_idf['meta'].get('feature_version'))
+    if tuned is not None:
+        clf.set_params(**tuned.parameters)
+        stats['parameters'] = tuned.parameters
 
     current_training_set = project.get_current_training_set()
 
@@ -257,158 +354,1466 @@ def train_and_save_model(project):
     # Order both X and Y by upload_id_hash to ensure the tf-idf vector corresponds to the correct
     # label
 
-    labeled_data = DataLabel.objects.filter(data__project=project)
-    unique_ids = list(labeled_data.values_list("data__upload_id",
-                                               flat=True).order_by('data__upload_id_hash'))
-    labeled_values = list(labeled_data.values_list(
-        'label', flat=True).order_by('data__upload_id_hash'))
+    with record_stage(stats, 'load_labels') as stage:
+        # Labels keep coming in while the model trains and predicts, those after
+        # this mark are left for the next model
+        last_label_pk = DataLabel.objects.filter(data__project=project).aggregate(
+            last=Max('pk'))['last'] or 0
+        labeled_data = DataLabel.objects.filter(data__project=project, pk__lte=last_label_pk)
+        unique_ids, Y = get_labeled_rows(labeled_data)
+        stage['rows'] = len(Y)
+
+    with reserve_training_cores(settings.TRAINING_N_JOBS) as n_jobs, \
+            parallel_backend(get_parallel_backend()), \
+            record_stage(stats, 'fit') as fit_stage:
+        set_n_jobs(clf, n_jobs)
+        updated_clf = None
+        if incremental:
+            updated_clf = update_model_incrementally(project, tf_idf, current_training_set, Y,
+                                                     last_label_pk)
+        if updated_clf is not None:
+            clf = updated_clf
+            strategy, training_rows, training_budget = 'incremental', len(Y), None
+        else:
+            strategy, fit_ids, fit_labels = 'full', unique_ids, Y
+            max_rows = get_training_row_budget(project)
+            training_budget = None
+            if max_rows is not None and len(Y) > max_rows:
+                # The same training set always draws the same sample
+                rows = stratified_subsample(Y, max_rows, current_training_set.set_number)
+                strategy, training_budget = 'subsample', max_rows
+                fit_ids = [unique_ids[i] for i in rows]
+                fit_labels = [Y[i] for i in rows]
+            X = get_tfidf_rows(tf_idf, fit_ids)
+            fit_classifier(clf, X, fit_labels)
+            training_rows = len(fit_labels)
+        # the saved model predicts with a single core
+        set_n_jobs(clf, 1)
+        fit_stage['rows'] = training_rows
+    stats['n_jobs'] = n_jobs
+    stats['training_strategy'] = strategy
+
+    with record_stage(stats, 'save_model'):
+        fpath = save_model_artifact(clf, project, current_training_set, {
+            'classifier': project.classifier,
+            'estimator': type(clf).__name__,
+            'parameters': stats.get('parameters', {}),
+            'incremental': updated_clf is not None,
+            'training_strategy': strategy,
+            'feature_version': tf_idf['meta'].get('feature_version'),
+            'feature_fingerprint': tf_idf['meta'].get('fingerprint'),
+            'training_size': training_rows,
+            'n_jobs': n_jobs,
+            'timings': {'fit': fit_stage['seconds']}
+        })
+
+    model = Model.objects.create(pickle_path=fpath, project=project,
+                                 training_set=current_training_set,
+                                 feature_version=tf_idf['meta'].get('feature_version'),
+                                 training_strategy=strategy, training_rows=training_rows,
+                                 training_budget=training_budget, last_label_pk=last_label_pk,
+                                 label_order=[int(label) for label in clf.classes_],
+                                 run_stats=stats)
+    prune_model_artifacts(project)
+    # The model is predicted with right away, this also drops the previous model
+    # of the project from the cache
+    put_cached('model', project.pk, (model.pk, model.pickle_path), clf)
+
+    return model
+
+
+def compute_cv_metrics(model):
+    """Cross validate the classifier of a model on the data it was trained on and
+        save the accuracy and the precision, recall and f1 of each label to the
+        model.  This runs in the background after the model has been used to
+        predict and fill the queue
+
+    Args:
+        model: Model object
+    Returns:
+        model: The Model object with its metrics set
+    """
+    clf = load_cached_model(model)
+    tf_idf = load_cached_tfidf_matrix(model.project.pk)
 
-    X = [tf_idf[id] for id in unique_ids]
-    Y = labeled_values
-    clf.fit(X, Y)
+    if model.last_label_pk is not None:
+        labeled_data = DataLabel.objects.filter(data__project=model.project, pk__lte=model.last_label_pk)
+    else:
+        labeled_data = DataLabel.objects.filter(
+            data__project=model.project,
+            training_set__set_number__lte=model.training_set.set_number)
+    unique_ids, Y = get_labeled_rows(labeled_data)
+    if model.training_strategy == 'subsample' and model.training_budget is not None:
+        # Cross validate on the sample the model was fit on, drawn again from the
+        # same labels with the same budget and seed
+        rows = stratified_subsample(Y, model.training_budget, model.training_set.set_number)
+        unique_ids = [unique_ids[i] for i in rows]
+        Y = [Y[i] for i in rows]
+    X = get_tfidf_rows(tf_idf, unique_ids)
 
     classes = [str(c) for c in clf.classes_]
     keys = ('precision', 'recall', 'f1')
-    cv_predicts = cross_val_predict(clf, X, Y, cv=5)
-    cv_accuracy = accuracy_score(Y, cv_predicts)
+    # The folds are fit in parallel, each with a single core
+    estimator = clone(clf)
+    set_n_jobs(estimator, 1)
+    stats = model.run_stats if model.run_stats is not None else new_run_stats()
+    with reserve_training_cores(settings.TRAINING_N_JOBS) as n_jobs, \
+            parallel_backend(get_parallel_backend()), \
+            record_stage(stats, 'cross_validation') as stage:
+        cv_predicts = cross_validate_classifier(estimator, X, Y, n_jobs)
+        stage['rows'] = len(Y)
+    model.run_stats = stats
+    model.cv_accuracy = accuracy_score(Y, cv_predicts)
     metrics = precision_recall_fscore_support(Y, cv_predicts)
     metric_map = map(lambda x: dict(zip(classes, x)), metrics[:3])
-    cv_metrics = dict(zip(keys, metric_map))
+    model.cv_metrics = dict(zip(keys, metric_map))
+    model.save()
 
-    fpath = os.path.join(settings.MODEL_PICKLE_PATH, 'project_' + str(project.pk) + '_training_'
-                         + str(current_training_set.set_number) + '.pkl')
+    return model
 
-    joblib.dump(clf, fpath)
 
-    model = Model.objects.create(pickle_path=fpath, project=project,
-                                 training_set=current_training_set,
-                                 cv_accuracy=cv_accuracy,
-                                 cv_metrics=cv_metrics)
+def get_parameter_grid(clf):
+    """Get the small grid of parameters the hyperparameter search tries for a
+        classifier.  The defaults of get_classifier are always in the grid.
 
-    return model
+    Args:
+        clf: The classifier
+    Returns:
+        grid: dict of parameter name to the values to try, empty if the
+            classifier is not tuned
+    """
+    if isinstance(clf, SGDClassifier):
+        return {'alpha': [1e-5, 1e-4, 1e-3]}
+    elif isinstance(clf, (LogisticRegression, SVC)):
+        return {'C': [0.1, 1.0, 10.0]}
+    elif isinstance(clf, CalibratedClassifierCV):
+        return {'base_estimator__C': [0.1, 1.0, 10.0]}
+    elif isinstance(clf, RandomForestClassifier):
+        return {'n_estimators': [10, 50], 'min_samples_leaf': [1, 3]}
+    return {}
+
+
+def get_tuned_parameters(project, clf, feature_version):
+    """Get the parameters the hyperparameter search found for a classifier of a
+        project on the current features
+
+    Args:
+        project: Project object
+        clf: The untrained classifier
+        feature_version: The feature_version of the tf-idf matrix
+    Returns:
+        tuned: TunedParameters object, or None if there was no search yet
+    """
+    if feature_version is None:
+        return None
+    return TunedParameters.objects.filter(project=project, estimator=type(clf).__name__,
+                                          feature_version=feature_version).first()
+
+
+def tune_hyperparameters(project):
+    """Search the parameter grid of the classifier of a project with cross
+        validation on the labeled data, and save the best parameters for the
+        current features.  Models trained afterwards use them, the search only
+        runs again once the tf-idf features are refit or the labeled data has
+        grown TUNING_LABEL_GROWTH times since the last search.
+
+    Args:
+        project: Project object
+    Returns:
+        tuned: TunedParameters object, or None if the classifier is not tuned or
+            there are too few labels to cross validate
+    """
+    incremental = project.incremental_training and project.classifier == "logistic regression"
+    clf = get_classifier(project.classifier, incremental)
+    if clf is None or len(get_parameter_grid(clf)) == 0:
+        return None
+
+    tf_idf = load_cached_tfidf_matrix(project.pk)
+    feature_version = tf_idf['meta'].get('feature_version')
+    if feature_version is None:
+        return None
+    tuned = get_tuned_parameters(project, clf, feature_version)
+    num_labels = DataLabel.objects.filter(data__project=project).count()
+    if tuned is not None and num_labels < tuned.num_labels * settings.TUNING_LABEL_GROWTH:
+        return tuned
+
+    unique_ids, Y = get_labeled_rows(DataLabel.objects.filter(data__project=project))
+    _, class_counts = np.unique(Y, return_counts=True)
+    # every fold needs a datum of every class
+    num_folds = min(settings.TUNING_CV_FOLDS, class_counts.min()) if len(class_counts) > 1 else 0
+    if num_folds < 2:
+        return None
+    if isinstance(clf, CalibratedClassifierCV):
+        # A search fold fits the linear svm on all but at most ceil(count / num_folds)
+        # of the examples of a label, and calibrates it over folds of those
+        min_train_count = class_counts.min() - -(-class_counts.min() // num_folds)
+        if min_train_count < 2:
+            return None
+        clf.set_params(cv=int(min(CALIBRATION_FOLDS, min_train_count)))
+    X = get_tfidf_rows(tf_idf, unique_ids)
+
+    # The candidates are fit in parallel, each with a single core
+    with reserve_training_cores(settings.TRAINING_N_JOBS) as n_jobs, \
+            parallel_backend(get_parallel_backend()):
+        search = GridSearchCV(clf, get_parameter_grid(clf), scoring='f1_macro', cv=num_folds,
+                              n_jobs=n_jobs, refit=False)
+        search.fit(X, Y, **get_fit_params(clf, Y))
+
+    tuned, _ = TunedParameters.objects.update_or_create(
+        project=project, estimator=type(clf).__name__, feature_version=feature_version,
+        defaults={'parameters': search.best_params_, 'score': float(search.best_score_),
+                  'num_labels': len(Y)})
+    return tuned
+
+
+def get_labeled_rows(labeled_data):
+    """Get the tf-idf row ids and the labels of labeled data, both ordered by
+        upload_id_hash so they line up.  Near duplicates use the tf-idf row of
+        their representative
+
+    Args:
+        labeled_data: DataLabel queryset
+    Returns:
+        unique_ids: List of the Data pks of the tf-idf rows
+        labels: List of Label pks
+    """
+    unique_ids = list(labeled_data.annotate(
+        feature_pk=Coalesce('data__representative', 'data__pk', output_field=IntegerField())).values_list(
+        "feature_pk", flat=True).order_by('data__upload_id_hash'))
+    labels = list(labeled_data.values_list('label', flat=True).order_by('data__upload_id_hash'))
+
+    return unique_ids, labels
+
+
+def get_training_row_budget(project):
+    """Get the most labeled rows a model of the project may be fit on.  A time
+        budget is turned into rows by scaling the rows and fit time of the last
+        model fit on the whole or a sample of the labeled data, using how fast
+        the fit time of the classifier grows with the rows.
+
+    Args:
+        project: Project object
+    Returns:
+        max_rows: The number of rows, or None if there is no budget
+    """
+    max_rows = project.training_max_rows
+    if not project.training_max_seconds:
+        return max_rows
+
+    previous = Model.objects.filter(project=project, run_stats__isnull=False).exclude(
+        training_strategy='incremental').order_by('-pk').first()
+    if previous is None:
+        return max_rows
+    fit = [stage for stage in previous.run_stats.get('stages', []) if stage['name'] == 'fit']
+    if not fit or not fit[0].get('rows') or not fit[0].get('seconds'):
+        return max_rows
+
+    exponent = FIT_TIME_EXPONENTS.get(project.classifier, 1.0)
+    rows = int(fit[0]['rows'] * (project.training_max_seconds / fit[0]['seconds']) ** (1.0 / exponent))
+    return rows if max_rows is None else min(max_rows, rows)
+
+
+def stratified_subsample(labels, max_rows, random_state=None):
+    """Pick about max_rows of the labeled rows, keeping the share of each label.
+        Every label keeps at least one row, so a rare label can add a row over
+        max_rows.
+
+    Args:
+        labels: List of the label of each row
+        max_rows: The number of rows to keep
+        random_state: Seed of the sample
+    Returns:
+        rows: Sorted numpy array of the indices of the rows kept
+    """
+    labels = np.asarray(labels)
+    if len(labels) <= max_rows:
+        return np.arange(len(labels))
+
+    random = np.random.RandomState(random_state)
+    classes, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    sizes = np.maximum(1, (counts * max_rows) // len(labels))
+    rows = [random.choice(np.flatnonzero(inverse == i), size, replace=False)
+            for i, size in enumerate(sizes)]
+    return np.sort(np.concatenate(rows))
+
+
+def get_fit_params(clf, labels):
+    """Get the extra arguments to fit a classifier with.  The incremental logistic
+        regression is given the balanced class weights as sample weights
+
+    Args:
+        clf: The classifier
+        labels: The labels it is fit on
+    Returns:
+        fit_params: dict of keyword arguments for fit
+    """
+    if isinstance(clf, SGDClassifier):
+        return {'sample_weight': get_balanced_weights(labels, labels)}
+    return {}
+
+
+def requires_dense(clf):
+    """Check if a classifier needs dense input.  All the others are given the
+        sparse tf-idf rows
+
+    Args:
+        clf: The classifier
+    Returns:
+        Boolean
+    """
+    return isinstance(clf, GaussianNB)
+
+
+def iterate_dense_chunks(X):
+    """Densify a sparse matrix DENSE_CHUNK_SIZE rows at a time, so the memory used
+        does not grow with the number of rows
+
+    Args:
+        X: Sparse matrix
+    Yields:
+        (start, chunk): The first row of the chunk and its rows as an array
+    """
+    num_rows = X.shape[0]
+    for start in range(0, num_rows, settings.DENSE_CHUNK_SIZE):
+        # scipy 0.19 raises on a slice past the last row instead of clipping it
+        yield start, X[start:min(start + settings.DENSE_CHUNK_SIZE, num_rows)].toarray()
+
+
+def fit_classifier(clf, X, Y):
+    """Fit a classifier on sparse tf-idf rows.  Classifiers which need dense input
+        are fit with partial_fit on one dense chunk at a time
+
+    Args:
+        clf: The classifier
+        X: Sparse matrix of tf-idf rows
+        Y: The label of each row
+    Returns:
+        clf: The fitted classifier
+    """
+    if isinstance(clf, CalibratedClassifierCV):
+        return fit_calibrated_classifier(clf, X, Y)
+    if not requires_dense(clf):
+        return clf.fit(X, Y, **get_fit_params(clf, Y))
+
+    Y = np.asarray(Y)
+    classes = np.unique(Y)
+    for start, chunk in iterate_dense_chunks(X):
+        clf.partial_fit(chunk, Y[start:start + len(chunk)], classes=classes)
+    return clf
+
+
+def get_calibration_folds(labels):
+    """Get the number of folds to calibrate the probabilities of a linear svm over.
+        Every fold needs an example of each label to calibrate on
+
+    Args:
+        labels: The labels the classifier is fit on
+    Returns:
+        num_folds: At most CALIBRATION_FOLDS, below 2 if a label has a single example
+    """
+    _, class_counts = np.unique(labels, return_counts=True)
+    return int(min(CALIBRATION_FOLDS, class_counts.min()))
+
+
+def fit_calibrated_classifier(clf, X, Y):
+    """Fit a calibrated linear svm with as many calibration folds as its rarest
+        label allows.  A label with a single example can not be in both the data
+        the svm is fit on and the data it is calibrated on, so then the svm is fit
+        on all rows and calibrated on the same rows
+
+    Args:
+        clf: The CalibratedClassifierCV
+        X: Sparse matrix of tf-idf rows
+        Y: The label of each row
+    Returns:
+        clf: The fitted classifier
+    """
+    num_folds = get_calibration_folds(Y)
+    if num_folds >= 2:
+        return clf.set_params(cv=num_folds).fit(X, Y)
+
+    clf.base_estimator.fit(X, Y)
+    return clf.set_params(cv='prefit').fit(X, Y)
+
+
+def predict_classifier(clf, X):
+    """Get the probability of each class for sparse tf-idf rows.  Classifiers which
+        need dense input predict one dense chunk at a time
+
+    Args:
+        clf: The fitted classifier
+        X: Sparse matrix of tf-idf rows
+    Returns:
+        probabilities: Array with a row for each row of X and a column for each
+            class in clf.classes_
+    """
+    if not requires_dense(clf):
+        return clf.predict_proba(X)
+    return np.vstack([clf.predict_proba(chunk) for _, chunk in iterate_dense_chunks(X)])
+
+
+def cross_validate_classifier(clf, X, Y, n_jobs=1):
+    """Predict each row of X with a copy of the classifier fit on the other four
+        of five stratified folds
+
+    Args:
+        clf: The classifier
+        X: Sparse matrix of tf-idf rows
+        Y: The label of each row
+        n_jobs: Number of folds to fit in parallel
+    Returns:
+        predictions: Array with the predicted label of each row
+    """
+    if not requires_dense(clf) and not isinstance(clf, CalibratedClassifierCV):
+        return cross_val_predict(clf, X, Y, cv=5, n_jobs=n_jobs, fit_params=get_fit_params(clf, Y))
+
+    # cross_val_predict would pass the whole sparse fold to fit, and would keep the
+    # calibration folds of a linear svm even when a label of the fold has fewer
+    # examples, so the folds are fit with fit_classifier instead.  Dense folds are
+    # fit one after another to bound their memory
+    if requires_dense(clf):
+        n_jobs = 1
+    Y = np.asarray(Y)
+    predictions = np.empty_like(Y)
+    folds = StratifiedKFold(n_splits=5).split(X, Y)
+    for test, fold_predictions in Parallel(n_jobs=n_jobs)(
+            delayed(fit_and_predict_fold)(clf, X, Y, train, test) for train, test in folds):
+        predictions[test] = fold_predictions
+    return predictions
+
+
+def fit_and_predict_fold(clf, X, Y, train, test):
+    """Fit a copy of a classifier on the training rows of a cross validation fold
+        and predict the label of its test rows
+
+    Args:
+        clf: The classifier
+        X: Sparse matrix of tf-idf rows
+        Y: Array of the label of each row
+        train: The rows to fit on
+        test: The rows to predict
+    Returns:
+        test: The rows predicted
+        predictions: Array with the predicted label of each test row
+    """
+    fold_clf = fit_classifier(clone(clf), X[train], Y[train])
+    return test, fold_clf.classes_[predict_classifier(fold_clf, X[test]).argmax(axis=1)]
 
 
-def predict_data(project, model):
+def update_model_incrementally(project, tf_idf, training_set, all_labels, last_label_pk=None):
+    """Continue training the previous model of the project with partial_fit on only
+        the data labeled since it was trained, the labels after its last_label_pk.
+        A full refit is needed instead every INCREMENTAL_FULL_REFIT_INTERVAL
+        training sets, when the features changed, or when the new labels include a
+        class the previous model has not seen.
+
+    Args:
+        project: Project object
+        tf_idf: dict with the tf-idf matrix and its row ids
+        training_set: The current TrainingSet
+        all_labels: The label of every labeled datum, used to balance the classes
+        last_label_pk: The largest DataLabel pk to train on, None for all labels
+    Returns:
+        clf: The updated classifier, or None if it has to be refit on all labels
+    """
+    if training_set.set_number % settings.INCREMENTAL_FULL_REFIT_INTERVAL == 0:
+        return None
+
+    previous_model = Model.objects.filter(project=project).order_by('-pk').first()
+    if previous_model is None or not os.path.isfile(previous_model.pickle_path):
+        return None
+    # models saved before the mark was recorded can not tell which labels are new
+    if previous_model.last_label_pk is None:
+        return None
+    if (previous_model.feature_version is None
+            or previous_model.feature_version != tf_idf['meta'].get('feature_version')):
+        return None
+
+    # partial_fit changes the classifier, so it is not taken from the cache
+    clf = load_model_artifact(previous_model)
+    if not hasattr(clf, 'partial_fit'):
+        return None
+
+    new_labels = DataLabel.objects.filter(data__project=project, pk__gt=previous_model.last_label_pk)
+    if last_label_pk is not None:
+        new_labels = new_labels.filter(pk__lte=last_label_pk)
+    new_ids, new_values = get_labeled_rows(new_labels)
+    if not set(new_values).issubset(clf.classes_):
+        return None
+    if len(new_values) == 0:
+        return clf
+
+    X_new = get_tfidf_rows(tf_idf, new_ids)
+    sample_weight = get_balanced_weights(new_values, all_labels)
+    for _ in range(settings.INCREMENTAL_TRAINING_EPOCHS):
+        clf.partial_fit(X_new, new_values, sample_weight=sample_weight)
+
+    return clf
+
+
+def get_balanced_weights(labels, all_labels):
+    """Weight each label inversely to how often its class occurs, the same weights
+        as class_weight='balanced'
+
+    Args:
+        labels: The labels to weight
+        all_labels: The labels the class frequencies are counted from
+    Returns:
+        weights: Array with the weight of each label
+    """
+    classes, counts = np.unique(all_labels, return_counts=True)
+    class_weights = dict(zip(classes, len(all_labels) / (len(classes) * counts)))
+    return np.array([class_weights[label] for label in labels])
+
+
+def predict_data(project, model, stats=None):
     """Given a project and its model, predict any unlabeled data and create
         Prediction objects for each.  There will be #label * #unlabeled_data
         predictions.  This is because we are saving the probability of each label
-        for every data.
+        for every data.  The unlabeled data is predicted and saved
+        PREDICTION_CHUNK_SIZE data at a time, so the memory used does not grow
+        with the project and the predictions of the first blocks are saved early.
 
     Args:
         project: Project object
         model: Model object
+        stats: The stats of the run to add the prediction stages to
     Returns:
-        predictions: List of DataPrediction objects
+        predictions: DataPrediction queryset of the model, or its
+            DataPredictionSummary queryset with COMPACT_PREDICTIONS, in the
+            order they were saved.  The layout is recorded on the model so
+            readers find its predictions if the setting changes later
     """
-    clf = joblib.load(model.pickle_path)
-    tf_idf = load_tfidf_matrix(project.pk)
+    with record_stage(stats, 'load_model'):
+        clf = load_cached_model(model)
+        tf_idf = load_cached_tfidf_matrix(project.pk)
 
     # In order to predict need X (tf-idf vector) for every unlabeled datum. Order
     # X by upload_id_hash to ensure the tf-idf vector corresponds to the correct datum
     recycle_data = RecycleBin.objects.filter(data__project=project).values_list('pk', flat=True)
-    unlabeled_data = project.data_set.filter(datalabel__isnull=True).exclude(
+    unlabeled_data = project.data_set.filter(datalabel__isnull=True, representative=None).exclude(
         pk__in=recycle_data).order_by('upload_id_hash')
-    unique_ids = list(unlabeled_data.values_list("upload_id", flat=True).order_by('upload_id_hash'))
+    unique_ids = unlabeled_data.values_list("pk", flat=True).iterator()
 
-    # get the list of all data sorted by identifier
-    X = [tf_idf[id] for id in unique_ids]
-    predictions = clf.predict_proba(X)
+    model.compact_predictions = settings.COMPACT_PREDICTIONS
+    model.save(update_fields=['compact_predictions'])
+    if model.compact_predictions:
+        save, saved_class = save_prediction_summaries, DataPredictionSummary
+    else:
+        save, saved_class = save_predictions, DataPrediction
+
+    # predict the data block by block, each block sorted by identifier.  The
+    # stages of every block are added up
+    while True:
+        data_ids = list(islice(unique_ids, settings.PREDICTION_CHUNK_SIZE))
+        if not data_ids:
+            break
+        with record_stage(stats, 'predict') as stage:
+            X = get_tfidf_rows(tf_idf, data_ids)
+            predictions = predict_classifier(clf, X)
+            stage['rows'] = len(data_ids)
 
-    label_obj = [Label.objects.get(pk=label) for label in clf.classes_]
+        with record_stage(stats, 'save_predictions') as stage:
+            stage['rows'] = save(model, data_ids, predictions, clf.classes_)
 
-    bulk_predictions = []
-    for datum, prediction in zip(unlabeled_data, predictions):
-        # each prediction is an array of probabilities.  Each index in that array
-        # corresponds to the label of the same index in clf.classes_
-        for p, label in zip(prediction, label_obj):
-            bulk_predictions.append(DataPrediction(data=datum, model=model,
-                                                   label=label,
-                                                   predicted_probability=p))
+    return saved_class.objects.filter(model=model).order_by('pk')
 
-        # Need to crate uncertainty object so fill_queue can sort by one of the metrics
-        lc = least_confident(prediction)
-        ms = margin_sampling(prediction)
-        e = entropy(prediction)
 
-        DataUncertainty.objects.create(data=datum,
-                                       model=model,
-                                       least_confident=lc,
-                                       margin_sampling=ms,
-                                       entropy=e)
+def save_predictions(model, data_ids, predictions, labels):
+    """Save the predicted probabilities of each label and the uncertainty of each
+        datum.  The uncertainty of all the data is scored at once over the
+        prediction matrix, then both are streamed into the database with COPY
+        without building a model object for each row.
 
-    prediction_objs = DataPrediction.objects.bulk_create(bulk_predictions)
+    Args:
+        model: Model object
+        data_ids: List of the Data pks, in the order of the predictions
+        predictions: Array of the probability of each label for each datum
+        labels: The Label pks in the order of the columns of predictions
+    Returns:
+        num_predictions: The number of DataPrediction rows saved
+    """
+    labels = [int(label) for label in labels]
 
-    return prediction_objs
+    # each prediction is an array of probabilities.  Each index in that array
+    # corresponds to the label of the same index in clf.classes_
+    prediction_rows = ((data_id, model.pk, label, p)
+                       for data_id, prediction in zip(data_ids, predictions)
+                       for label, p in zip(labels, prediction.tolist()))
+    num_predictions = copy_rows(DataPrediction,
+                                ['data_id', 'model_id', 'label_id', 'predicted_probability'],
+                                prediction_rows)
 
+    # Need to crate uncertainty object so fill_queue can sort by one of the metrics
+    uncertainty_rows = zip(data_ids, repeat(model.pk), least_confident(predictions).tolist(),
+                           margin_sampling(predictions).tolist(), entropy(predictions).tolist())
+    copy_rows(DataUncertainty, ['data_id', 'model_id', 'least_confident', 'margin_sampling', 'entropy'],
+              uncertainty_rows)
 
-def create_tfidf_matrix(project_pk, max_df=0.995, min_df=0.005):
+    return num_predictions
+
+
+def save_prediction_summaries(model, data_ids, predictions, labels):
+    """Save the predictions of each datum as a single DataPredictionSummary row
+        holding the probability of every label, the most likely label and the
+        uncertainty.  The rows are streamed into the database with COPY.
+
+    Args:
+        model: Model object
+        data_ids: List of the Data pks, in the order of the predictions
+        predictions: Array of the probability of each label for each datum
+        labels: The Label pks in the order of the columns of predictions
+    Returns:
+        num_summaries: The number of DataPredictionSummary rows saved
+    """
+    labels = np.array([int(label) for label in labels])
+
+    # postgres arrays are written as {p1,p2,...} by COPY
+    probabilities = ('{' + ','.join(repr(p) for p in prediction.tolist()) + '}'
+                     for prediction in predictions)
+    summary_rows = zip(data_ids, repeat(model.pk), probabilities,
+                       labels[predictions.argmax(axis=1)].tolist(), predictions.max(axis=1).tolist(),
+                       least_confident(predictions).tolist(), margin_sampling(predictions).tolist(),
+                       entropy(predictions).tolist())
+    return copy_rows(DataPredictionSummary,
+                     ['data_id', 'model_id', 'probabilities', 'predicted_label_id', 'max_probability',
+                      'least_confident', 'margin_sampling', 'entropy'],
+                     summary_rows)
+
+
+def prune_predictions(project):
+    """Delete the predictions, uncertainties and prediction summaries of all but
+        the project.prediction_keep_last newest models of a project.  Only the
+        newest models are used to fill queues and show predictions.  Rows are
+        deleted PREDICTION_DELETE_BATCH_SIZE at a time, each batch in its own
+        short transaction, so coders are not blocked while a large project is
+        pruned.
+
+    Args:
+        project: Project object
+    Returns:
+        num_deleted: The number of rows deleted
+    """
+    if project.prediction_keep_last is None:
+        return 0
+
+    superseded = list(Model.objects.filter(project=project).order_by('-pk').values_list(
+        'pk', flat=True)[project.prediction_keep_last:])
+    if not superseded:
+        return 0
+
+    num_deleted = 0
+    for prediction_class in (DataPrediction, DataUncertainty, DataPredictionSummary):
+        while True:
+            batch = list(prediction_class.objects.filter(model__in=superseded).values_list(
+                'pk', flat=True)[:settings.PREDICTION_DELETE_BATCH_SIZE])
+            if not batch:
+                break
+            num_batch, _ = prediction_class.objects.filter(pk__in=batch).delete()
+            num_deleted += num_batch
+    return num_deleted
+
+
+def get_featurized_data(project_pk):
+    """Get the data which has a row in the tf-idf matrix of a project.  Near
+        duplicates are left out and use the row of their representative
+
+    Args:
+        project_pk: The pk of the project
+    Returns:
+        data: Data queryset
+    """
+    return Data.objects.filter(project__pk=project_pk, representative=None)
+
+
+def create_tfidf_matrix(project_pk, max_df=None, min_df=None, workers=None, dtype=np.float64):
     """Create a TF-IDF matrix. Make sure to order the data by upload_id_hash so that we
         can sync the data up again when training the model
 
     Args:
         project_pk: The pk of the project
+        max_df: Maximum document frequency of a term, defaults to TFIDF_MAX_DF
+        min_df: Minimum document frequency of a term, defaults to TFIDF_MIN_DF
+        workers: Number of processes to tokenize the data with, defaults to TFIDF_WORKERS
+        dtype: The dtype of the matrix and of the features the vectorizer returns
+    Returns:
+        tf_idf: dict with the CSR-format tf-idf `matrix` and the `data_ids` and
+            `upload_ids` of the datum stored in each row
+        fitted_vectorizer: The fitted TfidfVectorizer
+    """
+    if max_df is None:
+        max_df = settings.TFIDF_MAX_DF
+    if min_df is None:
+        min_df = settings.TFIDF_MIN_DF
+    if workers is None:
+        workers = settings.TFIDF_WORKERS
+
+    project_data = get_featurized_data(project_pk)
+    data_ids = []
+    upload_ids = []
+
+    if workers > 1:
+        tf_idf_matrix, vectorizer = fit_tfidf_parallel(
+            stream_corpus_chunks(project_data, data_ids, upload_ids), workers,
+            max_df=max_df, min_df=min_df)
+    else:
+        # fit_transform reads the texts once, so they are streamed from the database
+        # and only the term counts are kept in memory
+        vectorizer = TfidfVectorizer(max_df=max_df, min_df=min_df, stop_words='english')
+        tf_idf_matrix = vectorizer.fit_transform(stream_corpus(project_data, data_ids, upload_ids))
+
+    set_vectorizer_dtype(vectorizer, dtype)
+    if tf_idf_matrix.dtype != dtype:
+        tf_idf_matrix = tf_idf_matrix.astype(dtype)
+
+    tf_idf = {
+        'matrix': tf_idf_matrix,
+        'data_ids': np.array(data_ids, dtype=np.int64),
+        'upload_ids': np.array(upload_ids, dtype=str),
+        # the size of the fit, which the rows appended later are measured against
+        'meta': {'featurizer': 'tfidf', 'feature_version': uuid.uuid4().hex,
+                 'fit_rows': tf_idf_matrix.shape[0], 'fit_nnz': int(tf_idf_matrix.nnz)}
+    }
+
+    return tf_idf, vectorizer
+
+
+def set_vectorizer_dtype(vectorizer, dtype):
+    """Make a fitted TfidfVectorizer return features of the given dtype
+
+    Args:
+        vectorizer: The fitted TfidfVectorizer
+        dtype: The dtype of the features
+    """
+    vectorizer.dtype = dtype
+    # scikit-learn 0.19 applies the idf weights as a float64 diagonal matrix, which
+    # would turn float32 term counts back into float64
+    vectorizer._tfidf._idf_diag = vectorizer._tfidf._idf_diag.astype(dtype)
+
+
+def count_terms(texts):
+    """Tokenize and count the terms in a chunk of text.  This runs in the worker
+        processes of fit_tfidf_parallel
+
+    Args:
+        texts: List of text
+    Returns:
+        vocabulary: dict of term to column in counts
+        counts: CSR-format matrix of term counts
+    """
+    vectorizer = CountVectorizer(stop_words='english')
+    try:
+        counts = vectorizer.fit_transform(texts)
+    except ValueError:
+        # every text in the chunk was empty or only stop words
+        return {}, sparse.csr_matrix((len(texts), 0), dtype=np.int64)
+
+    return vectorizer.vocabulary_, counts
+
+
+def fit_tfidf_parallel(text_chunks, workers, max_df=None, min_df=None):
+    """Fit a TfidfVectorizer by tokenizing and counting each chunk of text in a pool
+        of worker processes, then merging the counts of all chunks into one
+        vocabulary.  This gives the same vectorizer and matrix as
+        TfidfVectorizer.fit_transform on all of the text.
+
+    Args:
+        text_chunks: Iterable of lists of text
+        workers: Number of worker processes
+        max_df: Maximum document frequency of a term, defaults to TFIDF_MAX_DF
+        min_df: Minimum document frequency of a term, defaults to TFIDF_MIN_DF
     Returns:
         tf_idf_matrix: CSR-format tf-idf matrix
+        vectorizer: The fitted TfidfVectorizer
     """
-    project_data = Data.objects.filter(project__pk=project_pk)
-    id_list = list(project_data.values_list('upload_id', flat=True).order_by('upload_id_hash'))
-    data_list = list(project_data.values_list('text', flat=True).order_by('upload_id_hash'))
+    if max_df is None:
+        max_df = settings.TFIDF_MAX_DF
+    if min_df is None:
+        min_df = settings.TFIDF_MIN_DF
+
+    vocabulary = {}
+    data = []
+    indices = []
+    row_lengths = []
+
+    # billiard, unlike multiprocessing, can start a pool from inside a celery worker
+    with Pool(processes=workers) as pool:
+        text_chunks = iter(text_chunks)
+        while True:
+            # Only give the pool a few chunks at a time so the amount of text
+            # read ahead of the workers stays bounded
+            batch = list(islice(text_chunks, workers * 2))
+            if len(batch) == 0:
+                break
+
+            for chunk_vocabulary, counts in pool.map(count_terms, batch):
+                # map the columns of the chunk onto the merged vocabulary
+                column_map = np.empty(len(chunk_vocabulary), dtype=np.int64)
+                for term, column in chunk_vocabulary.items():
+                    column_map[column] = vocabulary.setdefault(term, len(vocabulary))
+
+                data.append(counts.data)
+                indices.append(column_map[counts.indices])
+                row_lengths.append(np.diff(counts.indptr))
+
+    if len(row_lengths) == 0:
+        raise ValueError('There is no text to build a tf-idf matrix from')
+
+    indptr = np.concatenate([[0], np.cumsum(np.concatenate(row_lengths))])
+    counts = sparse.csr_matrix((np.concatenate(data), np.concatenate(indices), indptr),
+                               shape=(len(indptr) - 1, len(vocabulary)))
+
+    # Apply max_df and min_df, and sort the terms, the same way CountVectorizer does
+    num_docs = counts.shape[0]
+    doc_freq = np.bincount(counts.indices, minlength=counts.shape[1])
+    max_doc_count = max_df if isinstance(max_df, numbers.Integral) else max_df * num_docs
+    min_doc_count = min_df if isinstance(min_df, numbers.Integral) else min_df * num_docs
+    terms = sorted(term for term, column in vocabulary.items()
+                   if min_doc_count <= doc_freq[column] <= max_doc_count)
+    if len(terms) == 0:
+        raise ValueError('After pruning, no terms remain. Try a lower min_df or a higher max_df.')
+    counts = counts[:, [vocabulary[term] for term in terms]]
 
     vectorizer = TfidfVectorizer(max_df=max_df, min_df=min_df, stop_words='english')
-    fitted_vectorizer = vectorizer.fit(data_list)
+    vectorizer.vocabulary_ = dict((term, column) for column, term in enumerate(terms))
+    vectorizer.fixed_vocabulary_ = False
+    # TfidfVectorizer keeps its idf weights in this TfidfTransformer
+    transformer = TfidfTransformer()
+    tf_idf_matrix = transformer.fit_transform(counts)
+    vectorizer._tfidf = transformer
+
+    return tf_idf_matrix, vectorizer
+
+
+def iterate_corpus_chunks(project_data, chunk_size=None):
+    """Read data ordered by upload_id_hash through a single server-side cursor,
+        in chunks of TFIDF_CHUNK_SIZE rows
+
+    Args:
+        project_data: Data queryset to read
+        chunk_size: Number of rows per chunk, defaults to TFIDF_CHUNK_SIZE
+    Yields:
+        chunk: List of (pk, upload_id, text) tuples
+    """
+    if chunk_size is None:
+        chunk_size = settings.TFIDF_CHUNK_SIZE
+
+    rows = project_data.order_by('upload_id_hash').values_list('pk', 'upload_id', 'text').iterator()
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def stream_corpus_chunks(project_data, data_ids, upload_ids):
+    """Yield the text of the data in chunks, ordered by upload_id_hash, appending the
+        ids of each datum to data_ids and upload_ids as it goes
+
+    Args:
+        project_data: Data queryset to read
+        data_ids: List the Data pks are appended to
+        upload_ids: List the upload ids are appended to
+    Yields:
+        texts: List of the text of each datum in the chunk
+    """
+    for chunk in iterate_corpus_chunks(project_data):
+        data_ids.extend(pk for pk, _, _ in chunk)
+        upload_ids.extend(upload_id for _, upload_id, _ in chunk)
+        yield [text for _, _, text in chunk]
+
+
+def stream_corpus(project_data, data_ids, upload_ids):
+    """Yield the text of each datum, ordered by upload_id_hash, appending the ids of
+        each datum to data_ids and upload_ids as it goes
+
+    Args:
+        project_data: Data queryset to read
+        data_ids: List the Data pks are appended to
+        upload_ids: List the upload ids are appended to
+    Yields:
+        text: The text of the datum
+    """
+    for texts in stream_corpus_chunks(project_data, data_ids, upload_ids):
+        for text in texts:
+            yield text
+
+
+def update_tfidf_matrix(project_pk, dtype=np.float64):
+    """Add rows for data uploaded since the tf-idf matrix was saved, transforming
+        only the new data with the saved vectorizer.
+
+        The vocabulary and idf weights stay the ones of the last full fit, so the
+        matrix should be rebuilt with create_tfidf_matrix when all the data added
+        since that fit grows the project by more than TFIDF_REFIT_ROW_GROWTH, or
+        when the added data matches noticeably fewer vocabulary terms per datum
+        than the data of the fit (TFIDF_REFIT_MIN_COVERAGE), or when TFIDF_MAX_DF,
+        TFIDF_MIN_DF or the dtype change.
+
+    Args:
+        project_pk: The pk of the project
+        dtype: The dtype of the matrix
+    Returns:
+        tf_idf: dict with the updated tf-idf matrix and its row ids, or None if the
+            matrix needs to be rebuilt
+    """
+    try:
+        tf_idf = load_tfidf_matrix(project_pk)
+        vectorizer = load_cached_tfidf_vectorizer(project_pk)
+    except ValueError:
+        return None
+
+    num_rows = len(tf_idf['data_ids'])
+    if num_rows == 0 or tf_idf['meta'].get('featurizer', 'tfidf') != 'tfidf':
+        return None
+    if vectorizer.max_df != settings.TFIDF_MAX_DF or vectorizer.min_df != settings.TFIDF_MIN_DF:
+        return None
+    if tf_idf['matrix'].dtype != dtype:
+        return None
+
+    # Data is only ever added to a project, so the new data is everything with
+    # a larger pk than the data already in the matrix
+    project_data = get_featurized_data(project_pk)
+    new_data = project_data.filter(pk__gt=int(tf_idf['data_ids'].max()))
+    num_new_rows = new_data.count()
+    if project_data.count() != num_rows + num_new_rows:
+        return None
+    if num_new_rows == 0:
+        return tf_idf
+
+    # Growth and coverage are measured from the last full fit, so a series of
+    # small uploads adds up.  Matrices saved without the size of their fit
+    # count from their current size
+    fit_rows = tf_idf['meta'].get('fit_rows', num_rows)
+    fit_nnz = tf_idf['meta'].get('fit_nnz', tf_idf['matrix'].nnz)
+    added_rows = num_rows - fit_rows + num_new_rows
+    if added_rows / fit_rows > settings.TFIDF_REFIT_ROW_GROWTH:
+        return None
+
+    data_ids = []
+    upload_ids = []
+    new_matrix = vectorizer.transform(stream_corpus(new_data, data_ids, upload_ids))
+
+    # Compare the number of vocabulary terms found per datum to detect added data
+    # the vocabulary does not describe well
+    terms_per_row = fit_nnz / fit_rows
+    added_terms_per_row = (tf_idf['matrix'].nnz - fit_nnz + new_matrix.nnz) / added_rows
+    if added_terms_per_row < terms_per_row * settings.TFIDF_REFIT_MIN_COVERAGE:
+        return None
+
+    tf_idf = append_tfidf_rows(tf_idf, new_matrix, np.array(data_ids, dtype=np.int64),
+                               np.array(upload_ids, dtype=str))
+    tf_idf['meta'] = dict(tf_idf['meta'], fit_rows=fit_rows, fit_nnz=fit_nnz)
+    return tf_idf
+
+
+def append_tfidf_rows(tf_idf, matrix, data_ids, upload_ids):
+    """Append rows to a tf-idf matrix by concatenating the CSR arrays directly
+
+    Args:
+        tf_idf: dict with the CSR-format tf-idf matrix and its row ids
+        matrix: CSR-format matrix of the rows to add
+        data_ids: Data pks of the rows to add
+        upload_ids: Upload ids of the rows to add
+    Returns:
+        tf_idf: dict with the combined matrix and row ids
+    """
+    old_matrix = tf_idf['matrix']
+    nnz = old_matrix.nnz + matrix.nnz
+    idx_dtype = np.int64 if nnz > np.iinfo(np.int32).max else np.int32
+
+    indptr = np.concatenate([old_matrix.indptr.astype(idx_dtype),
+                             matrix.indptr[1:].astype(idx_dtype) + old_matrix.nnz])
+    combined = sparse.csr_matrix((np.concatenate([old_matrix.data, matrix.data]),
+                                  np.concatenate([old_matrix.indices, matrix.indices]).astype(idx_dtype),
+                                  indptr),
+                                 shape=(old_matrix.shape[0] + matrix.shape[0], old_matrix.shape[1]))
+
+    combined_tf_idf = dict(tf_idf)
+    combined_tf_idf.update({
+        'matrix': combined,
+        'data_ids': np.concatenate([tf_idf['data_ids'], data_ids]),
+        'upload_ids': np.concatenate([tf_idf['upload_ids'], upload_ids])
+    })
+
+    # New data has larger pks than the data already in the matrix, so the row
+    # index of the new rows can go after the existing index
+    index_ids, index_rows = get_row_index(tf_idf)
+    if len(index_ids) > 0 and len(data_ids) > 0 and data_ids.min() <= index_ids[-1]:
+        combined_tf_idf.pop('index_ids', None)
+        combined_tf_idf.pop('index_rows', None)
+    else:
+        new_index_rows = np.argsort(data_ids, kind='mergesort')
+        combined_tf_idf['index_ids'] = np.concatenate([index_ids, data_ids[new_index_rows]])
+        combined_tf_idf['index_rows'] = np.concatenate([index_rows, new_index_rows + old_matrix.shape[0]])
+
+    return combined_tf_idf
+
+
+def get_hashing_vectorizer(dtype=np.float64):
+    """Get the stateless vectorizer used by the hashing featurizer.  It gives the
+        raw term counts of each datum independently of all other data, the idf
+        weighting is applied from the document frequencies saved with the matrix
+
+    Args:
+        dtype: The dtype of the term counts
+    Returns:
+        vectorizer: HashingVectorizer
+    """
+    return HashingVectorizer(n_features=settings.HASHING_N_FEATURES, stop_words='english',
+                             alternate_sign=False, norm=None, dtype=dtype)
+
+
+def hash_terms(texts, dtype=np.float64):
+    """Hash the term counts of a chunk of text.  This runs in the worker processes
+        of hash_corpus_parallel
+
+    Args:
+        texts: List of text
+        dtype: The dtype of the term counts
+    Returns:
+        counts: CSR-format matrix of hashed term counts
+    """
+    return get_hashing_vectorizer(dtype).transform(texts)
+
+
+def hash_corpus_parallel(text_chunks, workers, dtype=np.float64):
+    """Hash the term counts of each chunk of text in a pool of worker processes.
+        The hashing vectorizer has no state, so stacking the counts of the chunks
+        gives the same matrix as hashing all of the text at once.
+
+    Args:
+        text_chunks: Iterable of lists of text
+        workers: Number of worker processes
+        dtype: The dtype of the term counts
+    Returns:
+        counts: CSR-format matrix of hashed term counts
+    """
+    counts = []
+    # billiard, unlike multiprocessing, can start a pool from inside a celery worker
+    with Pool(processes=workers) as pool:
+        text_chunks = iter(text_chunks)
+        while True:
+            # Only give the pool a few chunks at a time so the amount of text
+            # read ahead of the workers stays bounded
+            batch = list(islice(text_chunks, workers * 2))
+            if len(batch) == 0:
+                break
+            counts.extend(pool.map(partial(hash_terms, dtype=dtype), batch))
+
+    return sparse.vstack(counts, format='csr')
+
+
+def update_hashing_matrix(project_pk, dtype=np.float64, workers=None):
+    """Add rows for data uploaded since the hashed term count matrix was saved.
+        Each datum is hashed on its own, so no data already in the matrix is read,
+        and the document frequency of each feature is updated with the new rows.
+
+    Args:
+        project_pk: The pk of the project
+        dtype: The dtype of the matrix
+        workers: Number of processes to hash the data with, defaults to TFIDF_WORKERS
+    Returns:
+        tf_idf: dict with the CSR-format term count `matrix`, its row ids and the
+            `doc_freq` of each feature
+    """
+    if workers is None:
+        workers = settings.TFIDF_WORKERS
+    n_features = settings.HASHING_N_FEATURES
+    project_data = get_featurized_data(project_pk)
+    try:
+        tf_idf = load_tfidf_matrix(project_pk)
+    except ValueError:
+        tf_idf = None
+
+    if (tf_idf is not None and tf_idf['meta'].get('featurizer') == 'hashing'
+            and len(tf_idf['data_ids']) > 0 and tf_idf['matrix'].shape[1] == n_features
+            and tf_idf['matrix'].dtype == dtype):
+        new_data = project_data.filter(pk__gt=int(tf_idf['data_ids'].max()))
+        if project_data.count() != len(tf_idf['data_ids']) + new_data.count():
+            tf_idf = None
+    else:
+        tf_idf = None
+
+    if tf_idf is None:
+        new_data = project_data
+        tf_idf = {
+            'matrix': sparse.csr_matrix((0, n_features), dtype=dtype),
+            'data_ids': np.array([], dtype=np.int64),
+            'upload_ids': np.array([], dtype=str),
+            'doc_freq': np.zeros(n_features, dtype=np.int64),
+            'meta': {'featurizer': 'hashing', 'feature_version': uuid.uuid4().hex}
+        }
+
+    if not new_data.exists():
+        return tf_idf
+
+    data_ids = []
+    upload_ids = []
+    if workers > 1:
+        counts = hash_corpus_parallel(stream_corpus_chunks(new_data, data_ids, upload_ids), workers,
+                                      dtype=dtype)
+    else:
+        counts = hash_terms(stream_corpus(new_data, data_ids, upload_ids), dtype=dtype)
+    # duplicate features are summed per row, so counting the column indices
+    # gives the number of documents each feature appears in
+    doc_freq = tf_idf['doc_freq'] + np.bincount(counts.indices, minlength=n_features)
+
+    tf_idf = append_tfidf_rows(tf_idf, counts, np.array(data_ids, dtype=np.int64),
+                               np.array(upload_ids, dtype=str))
+    tf_idf['doc_freq'] = doc_freq
+
+    return tf_idf
+
+
+def get_hashing_transformer(tf_idf):
+    """Build the idf weighting of a hashed term count matrix from its saved document
+        frequencies, using the same smoothed idf as TfidfVectorizer
+
+    Args:
+        tf_idf: dict with the hashed term count matrix and its doc_freq
+    Returns:
+        transformer: TfidfTransformer with the idf weights set
+    """
+    num_docs = tf_idf['matrix'].shape[0]
+    idf = np.log((1 + num_docs) / (1 + tf_idf['doc_freq'])) + 1
+    transformer = TfidfTransformer()
+    # scikit-learn 0.19 stores the fitted idf weights as this diagonal matrix, in the
+    # dtype of the matrix so float32 counts stay float32
+    transformer._idf_diag = sparse.spdiags(idf.astype(tf_idf['matrix'].dtype), diags=0,
+                                           m=len(idf), n=len(idf), format='csr')
+
+    return transformer
+
+
+def get_hashing_pipeline(tf_idf):
+    """Get a vectorizer for the hashing featurizer which turns text into the same
+        features the model was trained on, saved in place of the TfidfVectorizer
+
+    Args:
+        tf_idf: dict with the hashed term count matrix and its doc_freq
+    Returns:
+        pipeline: Pipeline of the HashingVectorizer and idf weighting
+    """
+    return make_pipeline(get_hashing_vectorizer(tf_idf['matrix'].dtype),
+                         get_hashing_transformer(tf_idf))
+
 
-    tf_idf_matrix = fitted_vectorizer.transform(data_list)
+def get_tfidf_path(project_pk):
+    """Get the path the tf-idf matrix of a project is saved at.  This is a symlink
+        to the directory holding the current version of the matrix
 
-    new_dict = dict(zip(id_list, np.matrix.tolist(sparse.csr_matrix.todense(tf_idf_matrix))))
+    Args:
+        project_pk: The project pk the data comes from
+    Returns:
+        fpath: The path to the tf-idf matrix directory
+    """
+    return os.path.join(settings.TF_IDF_PATH, 'project_' + str(project_pk) + '_tfidf_matrix')
+
+
+def get_corpus_fingerprint(project_pk, featurizer, feature_dtype='float64'):
+    """Hash the data of a project, in order, together with the featurizer settings.
+        A saved matrix with the same fingerprint was built from exactly this data,
+        so it does not need to be featurized again.
+
+    Args:
+        project_pk: The pk of the project
+        featurizer: The featurizer of the project, 'tfidf' or 'hashing'
+        feature_dtype: The dtype of the matrix
+    Returns:
+        fingerprint: Hex digest of the data and featurizer settings
+    """
+    if featurizer == 'hashing':
+        params = {'featurizer': featurizer, 'n_features': settings.HASHING_N_FEATURES}
+    else:
+        params = {'featurizer': featurizer, 'max_df': settings.TFIDF_MAX_DF,
+                  'min_df': settings.TFIDF_MIN_DF}
+    params['dtype'] = feature_dtype
+    fingerprint = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+
+    # the matrix rows are keyed by pk, so a datum deleted and uploaded again
+    # has to change the fingerprint as well
+    rows = get_featurized_data(project_pk).order_by(
+        'upload_id_hash', 'hash').values_list('upload_id_hash', 'hash', 'pk').iterator()
+    for upload_id_hash, text_hash, pk in rows:
+        fingerprint.update((upload_id_hash + ' ' + text_hash + ' ' + str(pk) + '\n').encode())
 
-    return new_dict, fitted_vectorizer
+    return fingerprint.hexdigest()
 
 
-def save_tfidf_matrix(matrix, project_pk):
+def save_tfidf_matrix(tf_idf, project_pk):
     """Save tf-idf matrix to persistent volume storage defined in settings as
-        TF_IDF_PATH
+        TF_IDF_PATH.  The matrix is stored as a directory holding the CSR arrays
+        and the row index as .npy files.
+
+        Each save writes a new version directory and then atomically repoints the
+        project symlink at it, so workers that have the previous version memory
+        mapped are never handed a half written matrix.
 
     Args:
-        matrix: CSR-format tf-idf matrix
+        tf_idf: dict with the CSR-format tf-idf matrix and its row ids
         project_pk: The project pk the data comes from
     Returns:
         file: The filepath to the saved matrix
     """
-    fpath = os.path.join(settings.TF_IDF_PATH, 'project_' + str(project_pk) + '_tfidf_matrix.pkl')
-    with open(fpath, "wb") as tfidf_file:
-        pickle.dump(matrix, tfidf_file)
+    fpath = get_tfidf_path(project_pk)
+    version_path = fpath + '_' + timezone.now().strftime('%Y%m%d%H%M%S%f')
+    os.mkdir(version_path)
+
+    matrix = tf_idf['matrix']
+    arrays = {
+        'data': matrix.data,
+        'indices': matrix.indices,
+        'indptr': matrix.indptr,
+        'shape': np.array(matrix.shape, dtype=np.int64)
+    }
+    # the row ids and any arrays the featurizer needs
+    arrays.update((name, value) for name, value in tf_idf.items() if isinstance(value, np.ndarray))
+    arrays['index_ids'], arrays['index_rows'] = get_row_index(tf_idf)
+    for name, array in arrays.items():
+        np.save(os.path.join(version_path, name + '.npy'), array, allow_pickle=False)
+    with open(os.path.join(version_path, 'meta.json'), 'w') as meta_file:
+        json.dump(tf_idf.get('meta', {}), meta_file)
+
+    # matrices saved before versioning was added are plain directories
+    if os.path.isdir(fpath) and not os.path.islink(fpath):
+        shutil.rmtree(fpath)
+
+    tmp_link = version_path + '.link'
+    os.symlink(os.path.basename(version_path), tmp_link)
+    os.replace(tmp_link, fpath)
+
+    # Keep the previous version around for readers that resolved the link
+    # before it was swapped, remove anything older
+    versions = sorted(glob.glob(fpath + '_*[0-9]'))
+    for old_version in versions[:-2]:
+        shutil.rmtree(old_version, ignore_errors=True)
+    invalidate_cached(project_pk, 'tfidf')
 
     return fpath
 
 
 def save_tfidf_vectorizer(vectorizer, project_pk):
-    """Save tf-idf matrix to persistent volume storage defined in settings as
+    """Save tf-idf vectorizer to persistent volume storage defined in settings as
         TF_IDF_PATH
 
     Args:
-        matrix: CSR-format tf-idf matrix
+        vectorizer: The fitted TfidfVectorizer
         project_pk: The project pk the data comes from
     Returns:
-        file: The filepath to the saved matrix
+        file: The filepath to the saved vectorizer
     """
     fpath = os.path.join(settings.TF_IDF_PATH, 'project_' + str(project_pk) + '_vectorizer.pkl')
     with open(fpath, "wb") as tfidf_file:
         pickle.dump(vectorizer, tfidf_file)
+    invalidate_cached(project_pk, 'vectorizer')
     return fpath
 
 
-def load_tfidf_matrix(project_pk):
-    """Load tf-idf matrix from persistent volume, otherwise None
+def load_tfidf_vectorizer(project_pk):
+    """Load the fitted tf-idf vectorizer from persistent volume
 
     Args:
         project_pk: The project pk the data comes from
     Returns:
-        matrix or None
+        vectorizer: The fitted TfidfVectorizer
     """
-    fpath = os.path.join(settings.TF_IDF_PATH, 'project_' + str(project_pk) + '_tfidf_matrix.pkl')
+    fpath = os.path.join(settings.TF_IDF_PATH, 'project_' + str(project_pk) + '_vectorizer.pkl')
 
     if os.path.isfile(fpath):
         with open(fpath, "rb") as file:
             return pickle.load(file)
+    else:
+        raise ValueError('There was no tfidf vectorizer found for project: ' + str(project_pk))
+
+
+def load_cached_tfidf_vectorizer(project_pk):
+    """Get the fitted tf-idf vectorizer from the artifact cache of this worker,
+        loading it if it was saved since.  The vectorizer is shared and must not
+        be modified.
+
+    Args:
+        project_pk: The project pk the data comes from
+    Returns:
+        vectorizer: The fitted TfidfVectorizer
+    """
+    fpath = os.path.join(settings.TF_IDF_PATH, 'project_' + str(project_pk) + '_vectorizer.pkl')
+    if not os.path.isfile(fpath):
+        raise ValueError('There was no tfidf vectorizer found for project: ' + str(project_pk))
+    stat = os.stat(fpath)
+    return get_cached('vectorizer', project_pk, (fpath, stat.st_mtime_ns, stat.st_size),
+                      lambda: load_tfidf_vectorizer(project_pk))
+
+
+def load_tfidf_meta(project_pk):
+    """Load the metadata saved with the tf-idf matrix without loading the matrix
+
+    Args:
+        project_pk: The project pk the data comes from
+    Returns:
+        meta: dict of metadata, empty if there is no saved matrix
+    """
+    meta_path = os.path.join(get_tfidf_path(project_pk), 'meta.json')
+
+    if os.path.isfile(meta_path):
+        with open(meta_path) as meta_file:
+            return json.load(meta_file)
+    else:
+        return {}
+
+
+def load_tfidf_matrix(project_pk, mmap=True):
+    """Load tf-idf matrix from persistent volume, otherwise None
+
+    By default the arrays are memory mapped read-only, so only the pages of the
+    rows that are sliced out are read and every worker process loading the same
+    project shares one copy in the OS page cache.
+
+    Args:
+        project_pk: The project pk the data comes from
+        mmap: If False read the whole matrix into process memory
+    Returns:
+        tf_idf: dict with the CSR-format tf-idf matrix and its row ids
+    """
+    fpath = get_tfidf_path(project_pk)
+
+    if not os.path.isdir(fpath) and os.path.isfile(get_legacy_tfidf_path(project_pk)):
+        convert_legacy_tfidf_matrix(project_pk)
+
+    if os.path.isdir(fpath):
+        # Resolve the link once so all arrays come from the same version
+        version_path = os.path.realpath(fpath)
+        tf_idf = {'meta': {}}
+        for fname in os.listdir(version_path):
+            name, ext = os.path.splitext(fname)
+            if ext == '.npy':
+                tf_idf[name] = np.load(os.path.join(version_path, fname),
+                                       mmap_mode='r' if mmap else None, allow_pickle=False)
+            elif fname == 'meta.json':
+                with open(os.path.join(version_path, fname)) as meta_file:
+                    tf_idf['meta'] = json.load(meta_file)
+
+        # copy=False keeps the memory mapped arrays as the matrix storage
+        tf_idf['matrix'] = sparse.csr_matrix(
+            (tf_idf.pop('data'), tf_idf.pop('indices'), tf_idf.pop('indptr')),
+            shape=tuple(tf_idf.pop('shape')), copy=False)
+        return tf_idf
     else:
         raise ValueError('There was no tfidf matrix found for project: ' + str(project_pk))
+
+
+def get_legacy_tfidf_path(project_pk):
+    """Get the path of a tf-idf matrix saved before the matrix was stored as CSR
+        arrays, a pickled dict of upload_id to the dense row of the datum
+
+    Args:
+        project_pk: The project pk the data comes from
+    Returns:
+        fpath: The path to the pickle
+    """
+    return os.path.join(settings.TF_IDF_PATH, 'project_' + str(project_pk) + '_tfidf_matrix.pkl')
+
+
+def convert_legacy_tfidf_matrix(project_pk):
+    """Convert a pickled dense tf-idf matrix to the CSR arrays saved by
+        save_tfidf_matrix, so projects created before that keep working with the
+        vectorizer they were fit with.  The matrix is saved without a
+        fingerprint, so the next featurization task brings it up to date.
+
+    Args:
+        project_pk: The project pk the data comes from
+    Returns:
+        file: The filepath to the saved matrix
+    """
+    legacy_path = get_legacy_tfidf_path(project_pk)
+    with open(legacy_path, 'rb') as legacy_file:
+        rows = pickle.load(legacy_file)
+
+    # data uploaded after the matrix was saved has no row yet
+    data = ((pk, upload_id) for pk, upload_id in Data.objects.filter(project__pk=project_pk).order_by(
+        'upload_id_hash').values_list('pk', 'upload_id').iterator() if upload_id in rows)
+    data_ids = []
+    upload_ids = []
+    blocks = []
+    # converted one block at a time, so only one block of rows is copied at once
+    for chunk in iter(lambda: list(islice(data, settings.DENSE_CHUNK_SIZE)), []):
+        data_ids.extend(pk for pk, _ in chunk)
+        upload_ids.extend(upload_id for _, upload_id in chunk)
+        blocks.append(sparse.csr_matrix(np.array([rows[upload_id] for _, upload_id in chunk],
+                                                 dtype=np.float64)))
+    if not blocks:
+        raise ValueError('There was no data for the tfidf matrix of project: ' + str(project_pk))
+
+    tf_idf = {
+        'matrix': sparse.vstack(blocks, format='csr'),
+        'data_ids': np.array(data_ids, dtype=np.int64),
+        'upload_ids': np.array(upload_ids, dtype=str),
+        'meta': {'featurizer': 'tfidf', 'feature_version': uuid.uuid4().hex}
+    }
+    fpath = save_tfidf_matrix(tf_idf, project_pk)
+    try:
+        os.remove(legacy_path)
+    except FileNotFoundError:
+        # another worker converted it at the same time
+        pass
+    return fpath
+
+
+def load_cached_tfidf_matrix(project_pk):
+    """Get the tf-idf matrix from the artifact cache of this worker, loading it if
+        a new version was saved since.  The matrix is shared and must not be
+        modified.
+
+    Args:
+        project_pk: The project pk the data comes from
+    Returns:
+        tf_idf: dict with the CSR-format tf-idf matrix and its row ids
+    """
+    # each save links the path to a new version directory
+    version = os.path.realpath(get_tfidf_path(project_pk))
+    return get_cached('tfidf', project_pk, version, lambda: load_tfidf_matrix(project_pk))
+
+
+def get_tfidf_rows(tf_idf, data_ids):
+    """Select the tf-idf rows for the given data
+
+    Args:
+        tf_idf: dict with the CSR-format tf-idf matrix and its row ids
+        data_ids: List of Data pks, in the order the rows should be returned
+    Returns:
+        matrix: CSR-format matrix with one row per datum
+    """
+    index_ids, index_rows = get_row_index(tf_idf)
+    data_ids = np.asarray(data_ids, dtype=np.int64)
+
+    positions = np.searchsorted(index_ids, data_ids)
+    found = positions < len(index_ids)
+    found[found] = index_ids[positions[found]] == data_ids[found]
+    if not found.all():
+        raise ValueError('There is no tfidf row for data: ' + str(data_ids[~found][0]))
+
+    matrix = tf_idf['matrix'][index_rows[positions]]
+
+    if tf_idf.get('meta', {}).get('featurizer') == 'hashing':
+        # The hashed matrix holds raw term counts, weight them by the current idf
+        matrix = get_hashing_transformer(tf_idf).transform(matrix)
+
+    return matrix
+
+
+def get_row_index(tf_idf):
+    """Get the row index of the tf-idf matrix, the data ids in sorted order and
+        the row of each, so rows can be found with a binary search.  The index is
+        saved with the matrix, and built here if it is missing or out of date.
+
+    Args:
+        tf_idf: dict with the CSR-format tf-idf matrix and its row ids
+    Returns:
+        index_ids: The sorted data ids
+        index_rows: The matrix row of each of index_ids
+    """
+    if 'index_ids' in tf_idf and len(tf_idf['index_ids']) == len(tf_idf['data_ids']):
+        return tf_idf['index_ids'], tf_idf['index_rows']
+
+    index_rows = np.argsort(tf_idf['data_ids'], kind='mergesort')
+    return tf_idf['data_ids'][index_rows], index_rows
@@ -0,0 +1,290 @@
+from django.conf import settings
+from django.db import connection, transaction
+
+import re
+import zlib
+import numpy as np
+from io import StringIO
+from itertools import islice
+
+from core.models import Data, NearDuplicateBucket, NearDuplicateSignature
+
+# Shingles are hashed into [0, MINHASH_PRIME) before applying the permutations
+MINHASH_PRIME = (1 << 31) - 1
+SHINGLE_SIZE = 5
+
+
+def get_shingles(text):
+    """Split text into its set of overlapping character n-grams, after lowercasing
+        it and reducing punctuation and whitespace to single spaces.  Character
+        shingles keep short texts like tweets similar to their retweets
+
+    Args:
+        text: The text of a datum
+    Returns:
+        shingles: set of strings
+    """
+    text = ' '.join(re.findall(r'\w+', text.lower()))
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return set(text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1))
+
+
+def get_minhash_permutations():
+    """Get the coefficients of the MINHASH_PERMUTATIONS hash functions
+        (a * x + b) % MINHASH_PRIME.  They are seeded so the signatures of every
+        upload can be compared
+
+    Returns:
+        a: Array of multipliers
+        b: Array of offsets
+    """
+    rng = np.random.RandomState(1)
+    a = rng.randint(1, MINHASH_PRIME, settings.MINHASH_PERMUTATIONS, dtype=np.int64)
+    b = rng.randint(0, MINHASH_PRIME, settings.MINHASH_PERMUTATIONS, dtype=np.int64)
+    return a, b
+
+
+def minhash_signatures(texts):
+    """Compute the MinHash signature of each text.  The fraction of equal values in
+        two signatures estimates the Jaccard similarity of the shingles of the texts
+
+    Args:
+        texts: List of text
+    Returns:
+        signatures: Array with one row of MINHASH_PERMUTATIONS values per text
+    """
+    a, b = get_minhash_permutations()
+    signatures = np.empty((len(texts), len(a)), dtype=np.int64)
+    for i, text in enumerate(texts):
+        hashes = np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in get_shingles(text)],
+                          dtype=np.int64) % MINHASH_PRIME
+        # both factors are below 2^31, so the products fit in an int64
+        signatures[i] = ((np.outer(hashes, a) + b) % MINHASH_PRIME).min(axis=0)
+    return signatures
+
+
+def lsh_buckets(signatures):
+    """Split each signature into MINHASH_BANDS bands and hash each band to a bucket.
+        Texts whose signatures agree on every value of any band share that bucket,
+        which is likely for near duplicates and unlikely for anything else
+
+    Args:
+        signatures: Array of MinHash signatures
+    Returns:
+        buckets: int64 array with one bucket per band for each signature
+    """
+    num_bands = settings.MINHASH_BANDS
+    rows = signatures.shape[1] // num_bands
+    coefficients = np.random.RandomState(2).randint(
+        1, np.iinfo(np.int64).max, rows, dtype=np.int64).astype(np.uint64)
+
+    bands = signatures[:, :num_bands * rows].reshape(-1, num_bands, rows).astype(np.uint64)
+    # uint64 arithmetic wraps around, which is fine for a hash
+    buckets = (bands * coefficients).sum(axis=2)
+    buckets += np.arange(num_bands, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    return buckets.view(np.int64)
+
+
+def get_uncompared_data(project):
+    """Get the data of a project which were not compared against the rest yet.
+        Compared data either have a representative or are in the LSH buckets
+
+    Args:
+        project: Project object
+    Returns:
+        data: Data queryset
+    """
+    return Data.objects.filter(project=project, representative=None,
+                               nearduplicatesignature=None, nearduplicatebucket=None)
+
+
+def collapse_near_duplicates(project):
+    """Group the newly uploaded data with the near identical data already in the
+        project.  Each datum whose estimated Jaccard similarity to an earlier datum
+        is at least NEAR_DUPLICATE_THRESHOLD gets that datum as its representative,
+        all other data become representatives themselves and are added to the LSH
+        buckets with their signature.  Only representatives are featurized,
+        predicted and put in the queues.
+
+    Args:
+        project: Project object
+    Returns:
+        num_duplicates: The number of new data which are near duplicates
+    """
+    threshold = settings.NEAR_DUPLICATE_THRESHOLD
+    num_duplicates = 0
+
+    # Work in chunks so only the signatures of one chunk and its candidates are
+    # in memory.  The representatives of each chunk are saved to the buckets
+    # before the next chunk is read, so later chunks are compared against them
+    rows = get_uncompared_data(project).order_by('pk').values_list('pk', 'text').iterator()
+    while True:
+        chunk = list(islice(rows, settings.TFIDF_CHUNK_SIZE))
+        if len(chunk) == 0:
+            return num_duplicates
+
+        signatures = minhash_signatures([text for _, text in chunk])
+        buckets = lsh_buckets(signatures).tolist()
+
+        candidates = get_bucket_members(project, set(b for datum_buckets in buckets for b in datum_buckets))
+        candidate_signatures = get_signatures(
+            set(data_id for members in candidates.values() for data_id in members))
+
+        new_buckets = []
+        new_signatures = []
+        duplicates = []
+        for (pk, _), signature, datum_buckets in zip(chunk, signatures, buckets):
+            representative = find_representative(signature, datum_buckets, candidates,
+                                                 candidate_signatures, threshold)
+            if representative is None:
+                candidate_signatures[pk] = signature
+                new_signatures.append((pk, signature))
+                for bucket in datum_buckets:
+                    candidates.setdefault(bucket, []).append(pk)
+                    new_buckets.append((bucket, pk))
+            else:
+                duplicates.append((pk, representative))
+
+        with transaction.atomic():
+            save_buckets(project, new_buckets)
+            save_signatures(new_signatures)
+            save_representatives(duplicates)
+        num_duplicates += len(duplicates)
+
+
+def find_representative(signature, datum_buckets, candidates, candidate_signatures, threshold):
+    """Find the first representative sharing a bucket with a datum whose signature
+        is similar enough
+
+    Args:
+        signature: MinHash signature of the datum
+        datum_buckets: The buckets of the datum
+        candidates: dict of bucket to the representatives in it
+        candidate_signatures: dict of representative pk to its signature
+        threshold: Minimum estimated Jaccard similarity
+    Returns:
+        representative: The pk of the representative, or None
+    """
+    checked = set()
+    for bucket in datum_buckets:
+        for candidate in candidates.get(bucket, []):
+            if candidate in checked:
+                continue
+            checked.add(candidate)
+            if np.mean(signature == candidate_signatures[candidate]) >= threshold:
+                return candidate
+    return None
+
+
+def get_bucket_members(project, buckets):
+    """Get the representatives in each of the given buckets of a project
+
+    Args:
+        project: Project object
+        buckets: Iterable of bucket values
+    Returns:
+        members: dict of bucket to list of Data pks
+    """
+    buckets = list(buckets)
+    members = {}
+    for i in range(0, len(buckets), settings.TFIDF_CHUNK_SIZE):
+        for bucket, data_id in NearDuplicateBucket.objects.filter(
+                project=project, bucket__in=buckets[i:i + settings.TFIDF_CHUNK_SIZE]).values_list('bucket', 'data_id'):
+            members.setdefault(bucket, []).append(data_id)
+    return members
+
+
+def get_signatures(data_ids):
+    """Get the saved MinHash signatures of representatives.  The signatures of
+        representatives saved without one, or with a different number of
+        permutations, are computed from their text
+
+    Args:
+        data_ids: Iterable of Data pks
+    Returns:
+        signatures: dict of Data pk to its signature
+    """
+    data_ids = list(data_ids)
+    signatures = {}
+    for i in range(0, len(data_ids), settings.TFIDF_CHUNK_SIZE):
+        for data_id, signature in NearDuplicateSignature.objects.filter(
+                data__in=data_ids[i:i + settings.TFIDF_CHUNK_SIZE]).values_list('data_id', 'signature'):
+            if len(signature) == settings.MINHASH_PERMUTATIONS:
+                signatures[data_id] = np.array(signature, dtype=np.int64)
+
+    missing = [data_id for data_id in data_ids if data_id not in signatures]
+    if len(missing) > 0:
+        missing_data = list(Data.objects.filter(pk__in=missing).values_list('pk', 'text'))
+        signatures.update(zip([pk for pk, _ in missing_data],
+                              minhash_signatures([text for _, text in missing_data])))
+    return signatures
+
+
+def save_buckets(project, buckets):
+    """Insert the LSH buckets of new representatives using cursor.copy_from
+
+    Args:
+        project: Project object
+        buckets: List of (bucket, Data pk) tuples
+    """
+    if len(buckets) == 0:
+        return
+
+    stream = StringIO()
+    for bucket, data_id in buckets:
+        stream.write('{}\t{}\t{}\n'.format(project.pk, bucket, data_id))
+    stream.seek(0)
+
+    with connection.cursor() as c:
+        c.copy_from(stream, NearDuplicateBucket._meta.db_table,
+                    columns=['project_id', 'bucket', 'data_id'])
+
+
+def save_signatures(signatures):
+    """Insert the MinHash signatures of new representatives using cursor.copy_from
+
+    Args:
+        signatures: List of (Data pk, signature) tuples
+    """
+    if len(signatures) == 0:
+        return
+
+    stream = StringIO()
+    for data_id, signature in signatures:
+        stream.write('{}\t{{{}}}\n'.format(data_id, ','.join(str(value) for value in signature)))
+    stream.seek(0)
+
+    with connection.cursor() as c:
+        c.copy_from(stream, NearDuplicateSignature._meta.db_table, columns=['data_id', 'signature'])
+
+
+def save_representatives(duplicates):
+    """Set the representative of each near duplicate.  The pairs are copied into a
+        temporary table and applied with a single UPDATE
+
+    Args:
+        duplicates: List of (Data pk, representative Data pk) tuples
+    """
+    if len(duplicates) == 0:
+        return
+
+    stream = StringIO()
+    for data_id, representative_id in duplicates:
+        stream.write('{}\t{}\n'.format(data_id, representative_id))
+    stream.seek(0)
+
+    with connection.cursor() as c:
+        c.execute('CREATE TEMPORARY TABLE near_duplicates (data_id integer, representative_id integer)')
+        c.copy_from(stream, 'near_duplicates', columns=['data_id', 'representative_id'])
+        c.execute("""
+            UPDATE {data_table}
+            SET {representative_col} = near_duplicates.representative_id
+            FROM near_duplicates
+            WHERE {data_table}.{data_pk_col} = near_duplicates.data_id
+        """.format(
+            data_table=Data._meta.db_table,
+            representative_col=Data._meta.get_field('representative').column,
+            data_pk_col=Data._meta.pk.name
+        ))
+        c.execute('DROP TABLE near_duplicates')
@@ -5,9 +5,10 @@ from django.conf import settings
 import math
 
 from core.models import (Data, Queue, DataQueue, AssignedData, DataLabel, Model,
-                         DataUncertainty, RecycleBin, IRRLog)
+                         DataUncertainty, DataPredictionSummary, RecycleBin, IRRLog)
 from core.utils.utils_redis import (sync_redis_objects, redis_serialize_queue,
                                     redis_parse_queue, redis_parse_data)
+from core.utils.utils_near_duplicates import get_uncompared_data
 
 
 def find_queue_length(batch_size, num_coders):
@@ -44,6 +45,11 @@ def fill_queue(queue, orderby, irr_queue=None, irr_percent=10, batch_size=30):
     the project has a trained model
 
     Fill the IRR queue with the given percentage of values
+
+    Data of a project collapsing near duplicates are skipped until they are
+    compared, so a near duplicate is never queued in place of its representative
+
+    Returns the number of data added to the queue and the IRR queue
     '''
 
     ORDERBY_VALUE = {
@@ -62,10 +68,14 @@ def fill_queue(queue, orderby, irr_queue=None, irr_percent=10, batch_size=30):
         'project': queue.project,
         'labelers': None,
         'queues': None,
-        'irr_ind': False
+        'irr_ind': False,
+        'representative': None
     }
 
     eligible_data = Data.objects.filter(**data_filters).exclude(pk__in=recycled_data)
+    if queue.project.collapse_near_duplicates:
+        eligible_data = eligible_data.exclude(
+            pk__in=get_uncompared_data(queue.project).values('pk'))
 
     cte_sql, cte_params = eligible_data.query.sql_with_params()
 
@@ -89,6 +99,7 @@ def fill_queue(queue, orderby, irr_queue=None, irr_percent=10, batch_size=30):
 
         with connection.cursor() as c:
             c.execute(irr_sql, (*cte_params, *irr_sample_size_params))
+            num_added = c.rowcount
 
         data_ids = []
         with transaction.atomic():
@@ -102,6 +113,8 @@ def fill_queue(queue, orderby, irr_queue=None, irr_percent=10, batch_size=30):
         # get new eligible data by filtering out what was just chosen
         eligible_data = eligible_data.exclude(pk__in=data_ids)
         cte_sql, cte_params = eligible_data.query.sql_with_params()
+    else:
+        num_added = 0
 
     # get the remaining space in the normal queue
     non_irr_batch_size = math.ceil(batch_size * ((100 - irr_percent) / 100))
@@ -117,9 +130,12 @@ def fill_queue(queue, orderby, irr_queue=None, irr_percent=10, batch_size=30):
 
     with connection.cursor() as c:
         c.execute(sql, (*cte_params, *sample_size_params))
+        num_added += c.rowcount
 
     sync_redis_objects(queue, orderby)
 
+    return num_added
+
 
 def generate_sql_for_fill_queue(queue, orderby_value, join_clause, cte_sql, size_sql):
     '''
@@ -161,6 +177,13 @@ def get_join_clause(orderby, queue):
     if orderby == 'random':
         join_clause = ''
     else:
+        # both tables hold the uncertainty of each datum in the same columns, the
+        # newest model of the project records which one it saved to
+        model = Model.objects.filter(project=queue.project).order_by('-pk').first()
+        if model is not None and model.compact_predictions:
+            uncertainty_class = DataPredictionSummary
+        else:
+            uncertainty_class = DataUncertainty
         join_clause = """
         LEFT JOIN
             {datauncertainty_table} AS uncertainty
@@ -173,10 +196,10 @@ def get_join_clause(orderby, queue):
                 WHERE c_model.{model_project_id_col} = {project_id}
             )
         """.format(
-            datauncertainty_table=DataUncertainty._meta.db_table,
+            datauncertainty_table=uncertainty_class._meta.db_table,
             data_pk_col=Data._meta.pk.name,
-            datauncertainty_data_id_col=DataUncertainty._meta.get_field('data').column,
-            datauncertainty_model_id_col=DataUncertainty._meta.get_field('model').column,
+            datauncertainty_data_id_col=uncertainty_class._meta.get_field('data').column,
+            datauncertainty_model_id_col=uncertainty_class._meta.get_field('model').column,
             model_pk_col=Model._meta.pk.name,
             model_table=Model._meta.db_table,
             model_project_id_col=Model._meta.get_field('project').column,
@@ -1,8 +1,13 @@
 from django.db.utils import ProgrammingError
 from django.conf import settings
 from django.db.models import Max, Min
+from contextlib import contextmanager
 
-from core.models import Queue, Data, AssignedData
+import socket
+import time
+import uuid
+
+from core.models import Queue, Data, AssignedData, Model
 
 
 def redis_serialize_queue(queue):
@@ -20,6 +25,12 @@ def redis_serialize_data(datum):
     return 'data:' + str(datum.pk)
 
 
+def redis_serialize_cores():
+    """Serialize the training core reservations of this host for redis sorted
+    sets.  The format is 'cores:<hostname>'"""
+    return 'cores:' + socket.gethostname()
+
+
 def redis_parse_queue(queue_key):
     """Parse a queue key from redis and return the Queue object"""
     queue_pk = queue_key.decode().split(':')[1]
@@ -58,15 +69,21 @@ def get_ordered_data(data_ids, orderby):
                          + ' '.join(ORDERBY_OPTIONS))
 
     data_objs = Data.objects.filter(pk__in=data_ids)
+    # the newest model of the project records where it saved the uncertainty
+    model = Model.objects.filter(project__data__in=data_objs).order_by('-pk').first()
+    if model is not None and model.compact_predictions:
+        uncertainty = 'datapredictionsummary'
+    else:
+        uncertainty = 'datauncertainty'
 
     if orderby == 'random':
         return data_objs.order_by('?')
     elif orderby == 'least confident':
-        return data_objs.annotate(max_least_confident=Max('datauncertainty__least_confident')).order_by('-max_least_confident')
+        return data_objs.annotate(max_least_confident=Max(uncertainty + '__least_confident')).order_by('-max_least_confident')
     elif orderby == 'margin sampling':
-        return data_objs.annotate(min_margin_sampling=Min('datauncertainty__margin_sampling')).order_by('min_margin_sampling')
+        return data_objs.annotate(min_margin_sampling=Min(uncertainty + '__margin_sampling')).order_by('min_margin_sampling')
     elif orderby == 'entropy':
-        return data_objs.annotate(max_entropy=Max('datauncertainty__entropy')).order_by('-max_entropy')
+        return data_objs.annotate(max_entropy=Max(uncertainty + '__entropy')).order_by('-max_entropy')
 
 
 def init_redis():
@@ -136,3 +153,44 @@ def sync_redis_objects(queue, orderby):
 
         if len(ordered_data_ids) > 0:
             settings.REDIS.rpush(redis_serialize_queue(queue), *ordered_data_ids)
+
+
+@contextmanager
+def reserve_training_cores(requested):
+    """Reserve up to `requested` cores of this host for a training task.  All tasks
+    on a host share TRAINING_CORES, so concurrent celery tasks together never run
+    more jobs than there are cores.  At least one core is always granted, and a
+    reservation expires after TRAINING_CORES_TIMEOUT seconds in case a worker dies
+    without releasing it.
+
+    Args:
+        requested: The number of cores the task would like to use
+    Yields:
+        n_jobs: The number of cores the task may use
+    """
+    if requested <= 1:
+        yield 1
+        return
+
+    # Each reservation is a member '<token>:<cores>' scored by when it expires.
+    # The script drops expired reservations, sums the rest and grants what is left
+    script = settings.REDIS.register_script('''
+    local now = tonumber(ARGV[1])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+    local used = 0
+    for _, m in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+      used = used + tonumber(string.match(m, ':(%d+)$'))
+    end
+    local granted = math.max(1, math.min(tonumber(ARGV[2]), tonumber(ARGV[3]) - used))
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[4]), ARGV[5] .. ':' .. granted)
+    return granted
+    ''')
+
+    key = redis_serialize_cores()
+    token = uuid.uuid4().hex
+    granted = script(keys=[key], args=[time.time(), requested, settings.TRAINING_CORES,
+                                       settings.TRAINING_CORES_TIMEOUT, token])
+    try:
+        yield int(granted)
+    finally:
+        settings.REDIS.zrem(key, token + ':' + str(granted))
@@ -0,0 +1,182 @@
+from django.conf import settings
+from django.utils import timezone
+from sklearn.externals import joblib
+
+import os
+import json
+import hashlib
+import tempfile
+
+from core.models import Model
+from core.utils.utils_cache import get_cached
+
+# Bumped whenever the layout of the saved artifacts changes
+ARTIFACT_FORMAT_VERSION = 1
+
+
+def get_model_path(project, training_set):
+    """Get the path of the model artifact trained on a training set
+
+    Args:
+        project: Project object
+        training_set: TrainingSet object
+    Returns:
+        fpath: The path of the joblib file
+    """
+    return os.path.join(settings.MODEL_PICKLE_PATH, 'project_' + str(project.pk) + '_training_'
+                        + str(training_set.set_number) + '.pkl')
+
+
+def get_metadata_path(model_path):
+    """Get the path of the metadata header saved next to a model artifact
+
+    Args:
+        model_path: The path of the joblib file
+    Returns:
+        fpath: The path of the json file
+    """
+    return os.path.splitext(model_path)[0] + '.json'
+
+
+def file_checksum(fpath):
+    """Compute the sha256 of a file without reading it into memory at once
+
+    Args:
+        fpath: Path of the file
+    Returns:
+        checksum: hex digest
+    """
+    checksum = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def save_model_artifact(clf, project, training_set, metadata):
+    """Save a trained classifier to MODEL_PICKLE_PATH, compressed with
+        MODEL_COMPRESSION, along with a json header holding its checksum and
+        metadata.  Both are written to temporary files and moved into place so a
+        reader never sees a partial artifact.
+
+    Args:
+        clf: The trained classifier
+        project: Project object
+        training_set: The TrainingSet the classifier was trained on
+        metadata: dict with the classifier type, feature fingerprint, training
+            size and timings of the model
+    Returns:
+        fpath: The path of the saved artifact
+    """
+    fpath = get_model_path(project, training_set)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.MODEL_PICKLE_PATH, suffix='.tmp')
+    os.close(fd)
+    # mkstemp only lets the owner read the file
+    os.chmod(tmp_path, 0o644)
+    joblib.dump(clf, tmp_path, compress=settings.MODEL_COMPRESSION)
+
+    header = dict(metadata,
+                  format_version=ARTIFACT_FORMAT_VERSION,
+                  compression=settings.MODEL_COMPRESSION,
+                  checksum=file_checksum(tmp_path),
+                  size=os.path.getsize(tmp_path),
+                  created=timezone.now().isoformat())
+    meta_path = get_metadata_path(fpath)
+    with open(meta_path + '.tmp', 'w') as meta_file:
+        json.dump(header, meta_file)
+
+    os.replace(tmp_path, fpath)
+    os.replace(meta_path + '.tmp', meta_path)
+
+    return fpath
+
+
+def load_model_metadata(model_path):
+    """Load the json header of a model artifact
+
+    Args:
+        model_path: The path of the joblib file
+    Returns:
+        metadata: dict, empty for models saved before the registry was added
+    """
+    meta_path = get_metadata_path(model_path)
+    if not os.path.isfile(meta_path):
+        return {}
+    with open(meta_path) as meta_file:
+        return json.load(meta_file)
+
+
+def verify_model_artifact(model_path):
+    """Check a model artifact against the checksum in its json header.  Hashing
+        reads the whole file, so this is done when a model is exported rather
+        than every time it is loaded.
+
+    Args:
+        model_path: The path of the joblib file
+    Returns:
+        verified: False if the artifact does not match its checksum, True if it
+            does or was saved without one
+    """
+    metadata = load_model_metadata(model_path)
+    return 'checksum' not in metadata or metadata['checksum'] == file_checksum(model_path)
+
+
+def load_model_artifact(model, mmap=False, verify=False):
+    """Load the classifier of a model.  Uncompressed artifacts can have their
+        numpy arrays memory mapped instead of read, which makes large random
+        forests much faster to load.  Memory mapped arrays are read only, so a
+        classifier which will be updated must not be memory mapped.
+
+    Args:
+        model: Model object
+        mmap: If True, memory map the arrays of uncompressed artifacts
+        verify: If True, check the artifact against its checksum first
+    Returns:
+        clf: The trained classifier
+    """
+    if verify and not verify_model_artifact(model.pickle_path):
+        raise ValueError('The saved model does not match its checksum for model: ' + str(model.pk))
+
+    metadata = load_model_metadata(model.pickle_path)
+    mmap_mode = 'r' if mmap and metadata.get('compression', 0) == 0 else None
+    return joblib.load(model.pickle_path, mmap_mode=mmap_mode)
+
+
+def load_cached_model(model):
+    """Get the classifier of a model from the artifact cache of this worker, loading
+        it if needed.  The classifier is shared and must not be modified.
+
+    Args:
+        model: Model object
+    Returns:
+        clf: The trained classifier
+    """
+    return get_cached('model', model.project_id, (model.pk, model.pickle_path),
+                      lambda: load_model_artifact(model, mmap=True))
+
+
+def prune_model_artifacts(project):
+    """Delete the artifacts of all but the MODEL_KEEP_LAST newest models of a
+        project.  The Model objects are kept, since their predictions refer to them.
+
+    Args:
+        project: Project object
+    Returns:
+        num_pruned: The number of artifacts deleted
+    """
+    if settings.MODEL_KEEP_LAST is None:
+        return 0
+
+    model_paths = list(Model.objects.filter(project=project).order_by('-pk').values_list(
+        'pickle_path', flat=True))
+    # a model retrained on the same training set overwrites the same file
+    kept = set(model_paths[:settings.MODEL_KEEP_LAST])
+
+    num_pruned = 0
+    for model_path in set(model_paths[settings.MODEL_KEEP_LAST:]) - kept:
+        if os.path.isfile(model_path):
+            os.remove(model_path)
+            num_pruned += 1
+        if os.path.isfile(get_metadata_path(model_path)):
+            os.remove(get_metadata_path(model_path))
+    return num_pruned
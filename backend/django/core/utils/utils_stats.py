@@ -0,0 +1,75 @@
+from contextlib import contextmanager
+
+import time
+import socket
+import resource
+
+
+def new_run_stats():
+    """Start the stats of a model run
+
+    Returns:
+        stats: dict with the worker the run is on and an empty list of stages
+    """
+    return {'worker': socket.gethostname(), 'stages': []}
+
+
+def reset_peak_memory():
+    """Reset the peak resident memory of this process, so the peak of the next
+        stage can be measured.  Only Linux supports this, elsewhere the peak is
+        the peak of the whole process.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def get_peak_memory():
+    """Get the peak resident memory of this process since it was last reset
+
+    Returns:
+        peak_memory: Number of bytes
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def record_stage(stats, name):
+    """Record how long a stage of a model run takes and the peak memory used
+        during it.  The stage is yielded so the caller can add the number of rows
+        it handled.  Recording a stage the run already has adds its seconds and
+        rows to it, ex: for a stage done block by block.
+
+    Args:
+        stats: The stats of the run, from new_run_stats, or None to not record
+        name: The name of the stage
+    Yields:
+        stage: dict of the stage
+    """
+    stage = {'name': name, 'rows': None}
+    reset_peak_memory()
+    start = time.time()
+    yield stage
+    stage['seconds'] = time.time() - start
+    stage['peak_memory'] = get_peak_memory()
+    if stats is None:
+        return
+
+    previous = [s for s in stats['stages'] if s['name'] == name]
+    if not previous:
+        stats['stages'].append(stage)
+        return
+    previous[0]['seconds'] += stage['seconds']
+    previous[0]['peak_memory'] = max(previous[0]['peak_memory'], stage['peak_memory'])
+    if stage['rows'] is not None:
+        previous[0]['rows'] = (previous[0]['rows'] or 0) + stage['rows']
@@ -10,6 +10,8 @@ import tempfile
 
 from core.models import Project
 from core.utils.util import get_labeled_data
+from core.utils.utils_model import get_tfidf_path, load_tfidf_matrix
+from core.utils.utils_registry import get_metadata_path, verify_model_artifact
 from core.permissions import IsAdminOrCreator
 
 
@@ -55,8 +57,7 @@ def download_model(request, project_pk):
     # https://stackoverflow.com/questions/12881294/django-create-a-zip-of-multiple-files-and-make-it-downloadable
     zip_subdir = 'model_project' + str(project_pk)
 
-    tfidf_path = os.path.join(settings.TF_IDF_PATH, 'project_'
-                              + str(project_pk) + '_tfidf_matrix.pkl')
+    tfidf_path = get_tfidf_path(project_pk)
     tfidf_vectorizer_path = os.path.join(
         settings.TF_IDF_PATH, 'project_' + str(project_pk) + '_vectorizer.pkl')
     readme_path = os.path.join(settings.BASE_DIR, 'core', 'data', 'README.pdf')
@@ -67,6 +68,9 @@ def download_model(request, project_pk):
     current_training_set = project.get_current_training_set()
     model_path = os.path.join(settings.MODEL_PICKLE_PATH, 'project_' + str(project_pk)
                               + '_training_' + str(current_training_set.set_number - 1) + '.pkl')
+    # the checksum is checked once here rather than every time the model is loaded
+    if not verify_model_artifact(model_path):
+        return HttpResponse('The saved model does not match its checksum', status=500)
 
     data, label_data = get_labeled_data(project)
     # open the tempfile and write the label data to it
@@ -87,8 +91,20 @@ def download_model(request, project_pk):
     s = io.BytesIO()
     # open the zip folder
     zip_file = zipfile.ZipFile(s, "w")
+    if not os.path.isdir(tfidf_path):
+        try:
+            # converts a matrix saved in the old pickle format
+            load_tfidf_matrix(project_pk)
+        except ValueError:
+            pass
+    # the tf-idf matrix is a directory of arrays, write each of them to the zip folder.
+    # A project without one yet is downloaded without it
+    tfidf_dir = os.path.basename(tfidf_path)
+    if os.path.isdir(tfidf_path):
+        for fname in os.listdir(tfidf_path):
+            zip_file.write(os.path.join(tfidf_path, fname), os.path.join(zip_subdir, tfidf_dir, fname))
     for path in [
-        tfidf_path, tfidf_vectorizer_path, readme_path, model_path, temp_labeleddata_file.name,
+        tfidf_vectorizer_path, readme_path, model_path, temp_labeleddata_file.name,
         temp_label_file.name, dockerfile_path, requirements_path, start_script_path, usage_examples_path
     ]:
         fdir, fname = os.path.split(path)
@@ -99,6 +115,10 @@ def download_model(request, project_pk):
         # write the file to the zip folder
         zip_path = os.path.join(zip_subdir, fname)
         zip_file.write(path, zip_path)
+    # the checksum and training details of the model
+    model_meta_path = get_metadata_path(model_path)
+    if os.path.isfile(model_meta_path):
+        zip_file.write(model_meta_path, os.path.join(zip_subdir, os.path.basename(model_meta_path)))
     zip_file.close()
 
     response = HttpResponse(s.getvalue(), content_type="application/x-zip-compressed")
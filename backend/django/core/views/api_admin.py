@@ -8,7 +8,7 @@ from rest_framework.response import Response
 from postgres_stats.aggregates import Percentile
 
 from core.models import (Project, Model, Data, Label, DataLabel,
-                         DataPrediction, TrainingSet,
+                         DataPrediction, DataPredictionSummary, TrainingSet,
                          IRRLog, ProjectPermissions)
 from core.utils.util import perc_agreement_table_data, irr_heatmap_data
 from core.utils.utils_model import fleiss_kappa, cohens_kappa
@@ -107,7 +107,9 @@ def model_metrics(request, project_pk):
     metric = request.GET.get('metric', 'accuracy')
 
     project = Project.objects.get(pk=project_pk)
-    models = Model.objects.filter(project=project).order_by('training_set__set_number')
+    # Models whose cross validation has not finished yet have no metrics
+    models = Model.objects.filter(project=project, cv_accuracy__isnull=False).order_by(
+        'training_set__set_number')
 
     if metric == 'accuracy':
         values = []
@@ -142,6 +144,37 @@ def model_metrics(request, project_pk):
     return Response(dataset)
 
 
+@api_view(['GET'])
+@permission_classes((IsAdminOrCreator, ))
+def model_run_stats(request, project_pk):
+    """This function returns the time, number of rows and peak memory of each
+    stage of the runs which trained the models of a project, oldest first.
+    Args:
+        request: The GET request
+        project_pk: Primary key of the project
+    Returns:
+        a list with the training set, model and stats of each run
+    """
+    project = Project.objects.get(pk=project_pk)
+    models = Model.objects.filter(project=project, run_stats__isnull=False).order_by(
+        'training_set__set_number', 'pk')
+
+    runs = []
+    for model in models.select_related('training_set'):
+        stages = model.run_stats['stages']
+        runs.append({
+            'training_set': model.training_set.set_number,
+            'model': model.pk,
+            'worker': model.run_stats.get('worker'),
+            'n_jobs': model.run_stats.get('n_jobs'),
+            'total_seconds': sum(stage['seconds'] for stage in stages),
+            'peak_memory': max([stage['peak_memory'] for stage in stages] or [None]),
+            'stages': stages
+        })
+
+    return Response(runs)
+
+
 @api_view(['GET'])
 @permission_classes((IsAdminOrCreator, ))
 def data_coded_table(request, project_pk):
@@ -183,45 +216,83 @@ def data_predicted_table(request, project_pk):
     project = Project.objects.get(pk=project_pk)
     previous_run = project.get_current_training_set().set_number - 1
 
-    sql = """
-    SELECT d.{data_text_col}, l.{label_name_col}, dp.{pred_prob_col}
-    FROM (
-        SELECT {pred_data_id_col}, MAX({pred_prob_col}) AS max_prob
-        FROM {pred_table}
-        GROUP BY {pred_data_id_col}
-        ) as tmp
-    LEFT JOIN {pred_table} as dp
-    ON dp.{pred_data_id_col} = tmp.{pred_data_id_col} AND dp.{pred_prob_col} = tmp.max_prob
-    LEFT JOIN {label_table} as l
-    ON l.{label_pk_col} = dp.{pred_label_id_col}
-    LEFT JOIN {data_table} as d
-    ON d.{data_pk_col} = dp.{pred_data_id_col}
-    LEFT JOIN {model_table} as m
-    ON m.{model_pk_col} = dp.{pred_model_id_col}
-    LEFT JOIN {trainingset_table} as ts
-    ON ts.{trainingset_pk_col} = m.{model_trainingset_id_col}
-    WHERE ts.{trainingset_setnumber_col} = {previous_run} AND d.{data_project_id_col} = {project_pk}
-    """.format(
-        data_text_col=Data._meta.get_field('text').column,
-        label_name_col=Label._meta.get_field('name').column,
-        pred_prob_col=DataPrediction._meta.get_field('predicted_probability').column,
-        pred_data_id_col=DataPrediction._meta.get_field('data').column,
-        pred_table=DataPrediction._meta.db_table,
-        label_table=Label._meta.db_table,
-        label_pk_col=Label._meta.pk.name,
-        pred_label_id_col=DataPrediction._meta.get_field('label').column,
-        data_table=Data._meta.db_table,
-        data_pk_col=Data._meta.pk.name,
-        model_table=Model._meta.db_table,
-        model_pk_col=Model._meta.pk.name,
-        pred_model_id_col=DataPrediction._meta.get_field('model').column,
-        trainingset_table=TrainingSet._meta.db_table,
-        trainingset_pk_col=TrainingSet._meta.pk.name,
-        model_trainingset_id_col=Model._meta.get_field('training_set').column,
-        trainingset_setnumber_col=TrainingSet._meta.get_field('set_number').column,
-        previous_run=previous_run,
-        data_project_id_col=Data._meta.get_field('project').column,
-        project_pk=project.pk)
+    model = Model.objects.filter(project=project,
+                                 training_set__set_number=previous_run).order_by('-pk').first()
+    if model is not None and model.compact_predictions:
+        # the most likely label of each datum is kept in its summary row
+        sql = """
+        SELECT d.{data_text_col}, l.{label_name_col}, s.{max_prob_col}
+        FROM {summary_table} as s
+        LEFT JOIN {label_table} as l
+        ON l.{label_pk_col} = s.{summary_label_id_col}
+        LEFT JOIN {data_table} as d
+        ON d.{data_pk_col} = s.{summary_data_id_col}
+        LEFT JOIN {model_table} as m
+        ON m.{model_pk_col} = s.{summary_model_id_col}
+        LEFT JOIN {trainingset_table} as ts
+        ON ts.{trainingset_pk_col} = m.{model_trainingset_id_col}
+        WHERE ts.{trainingset_setnumber_col} = {previous_run} AND d.{data_project_id_col} = {project_pk}
+        """.format(
+            data_text_col=Data._meta.get_field('text').column,
+            label_name_col=Label._meta.get_field('name').column,
+            max_prob_col=DataPredictionSummary._meta.get_field('max_probability').column,
+            summary_table=DataPredictionSummary._meta.db_table,
+            label_table=Label._meta.db_table,
+            label_pk_col=Label._meta.pk.name,
+            summary_label_id_col=DataPredictionSummary._meta.get_field('predicted_label').column,
+            data_table=Data._meta.db_table,
+            data_pk_col=Data._meta.pk.name,
+            summary_data_id_col=DataPredictionSummary._meta.get_field('data').column,
+            model_table=Model._meta.db_table,
+            model_pk_col=Model._meta.pk.name,
+            summary_model_id_col=DataPredictionSummary._meta.get_field('model').column,
+            trainingset_table=TrainingSet._meta.db_table,
+            trainingset_pk_col=TrainingSet._meta.pk.name,
+            model_trainingset_id_col=Model._meta.get_field('training_set').column,
+            trainingset_setnumber_col=TrainingSet._meta.get_field('set_number').column,
+            previous_run=previous_run,
+            data_project_id_col=Data._meta.get_field('project').column,
+            project_pk=project.pk)
+    else:
+        sql = """
+        SELECT d.{data_text_col}, l.{label_name_col}, dp.{pred_prob_col}
+        FROM (
+            SELECT {pred_data_id_col}, MAX({pred_prob_col}) AS max_prob
+            FROM {pred_table}
+            GROUP BY {pred_data_id_col}
+            ) as tmp
+        LEFT JOIN {pred_table} as dp
+        ON dp.{pred_data_id_col} = tmp.{pred_data_id_col} AND dp.{pred_prob_col} = tmp.max_prob
+        LEFT JOIN {label_table} as l
+        ON l.{label_pk_col} = dp.{pred_label_id_col}
+        LEFT JOIN {data_table} as d
+        ON d.{data_pk_col} = dp.{pred_data_id_col}
+        LEFT JOIN {model_table} as m
+        ON m.{model_pk_col} = dp.{pred_model_id_col}
+        LEFT JOIN {trainingset_table} as ts
+        ON ts.{trainingset_pk_col} = m.{model_trainingset_id_col}
+        WHERE ts.{trainingset_setnumber_col} = {previous_run} AND d.{data_project_id_col} = {project_pk}
+        """.format(
+            data_text_col=Data._meta.get_field('text').column,
+            label_name_col=Label._meta.get_field('name').column,
+            pred_prob_col=DataPrediction._meta.get_field('predicted_probability').column,
+            pred_data_id_col=DataPrediction._meta.get_field('data').column,
+            pred_table=DataPrediction._meta.db_table,
+            label_table=Label._meta.db_table,
+            label_pk_col=Label._meta.pk.name,
+            pred_label_id_col=DataPrediction._meta.get_field('label').column,
+            data_table=Data._meta.db_table,
+            data_pk_col=Data._meta.pk.name,
+            model_table=Model._meta.db_table,
+            model_pk_col=Model._meta.pk.name,
+            pred_model_id_col=DataPrediction._meta.get_field('model').column,
+            trainingset_table=TrainingSet._meta.db_table,
+            trainingset_pk_col=TrainingSet._meta.pk.name,
+            model_trainingset_id_col=Model._meta.get_field('training_set').column,
+            trainingset_setnumber_col=TrainingSet._meta.get_field('set_number').column,
+            previous_run=previous_run,
+            data_project_id_col=Data._meta.get_field('project').column,
+            project_pk=project.pk)
 
     with connection.cursor() as c:
         c.execute(sql)
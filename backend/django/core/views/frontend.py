@@ -220,6 +220,14 @@ class ProjectCreateWizard(LoginRequiredMixin, SessionWizardView):
             proj_obj.percentage_irr = advanced_data["percentage_irr"]
             proj_obj.num_users_irr = advanced_data["num_users_irr"]
             proj_obj.classifier = advanced_data["classifier"]
+            proj_obj.featurizer = advanced_data["featurizer"]
+            proj_obj.feature_dtype = advanced_data["feature_dtype"]
+            proj_obj.collapse_near_duplicates = advanced_data["collapse_near_duplicates"]
+            proj_obj.incremental_training = advanced_data["incremental_training"]
+            proj_obj.tune_hyperparameters = advanced_data["tune_hyperparameters"]
+            proj_obj.training_max_rows = advanced_data["training_max_rows"]
+            proj_obj.training_max_seconds = advanced_data["training_max_seconds"]
+            proj_obj.prediction_keep_last = advanced_data["prediction_keep_last"]
             proj_obj.save()
 
             # Training Set
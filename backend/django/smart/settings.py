@@ -170,6 +170,75 @@ class Dev(Configuration):
     PROJECT_FILE_PATH = os.path.join(DATA_DIR, 'data_files')
     CODEBOOK_FILE_PATH = os.path.join(DATA_DIR, 'code_books')
 
+    # joblib compression level of saved models.  Only uncompressed models have
+    # their arrays memory mapped by prediction, which matters most for large random
+    # forests; a higher level trades that for smaller files
+    MODEL_COMPRESSION = 0
+    # Number of newest models per project whose files are kept, None keeps all
+    MODEL_KEEP_LAST = 3
+    # Bytes of models, vectorizers and tf-idf matrices each worker process keeps
+    # loaded, the least recently used are dropped first
+    ARTIFACT_CACHE_BYTES = 512 * 1024 * 1024
+
+    # Number of rows read from the database at a time when building the tf-idf matrix
+    TFIDF_CHUNK_SIZE = 10000
+    # Document frequency bounds of the terms kept by the tf-idf vectorizer
+    TFIDF_MAX_DF = 0.995
+    TFIDF_MIN_DF = 0.005
+    # Number of processes used to tokenize or hash the data when building the
+    # tf-idf matrix.  Only raise it on hosts with that many free cores, and time it
+    # there with benchmark_tfidf first
+    TFIDF_WORKERS = 1
+    # When new data is uploaded it is added to the existing tf-idf matrix with the
+    # saved vectorizer.  The vectorizer is refit on all data instead when the data
+    # added since the last fit grows the project by more than this fraction of its
+    # size at that fit...
+    TFIDF_REFIT_ROW_GROWTH = 0.5
+    # ...or when the added data matches less than this fraction of the vocabulary
+    # terms per datum that the data of the fit does
+    TFIDF_REFIT_MIN_COVERAGE = 0.8
+    # Number of features used by projects with the hashing featurizer
+    HASHING_N_FEATURES = 2 ** 18
+    # Projects which collapse near duplicates treat two texts as near duplicates
+    # when the estimated Jaccard similarity of their character 5-grams is at least this
+    NEAR_DUPLICATE_THRESHOLD = 0.8
+    # Number of MinHash values per text, split into this many LSH bands
+    MINHASH_PERMUTATIONS = 128
+    MINHASH_BANDS = 16
+    # Projects with incremental training update a logistic regression model with
+    # this many passes over only the newly labeled data, and refit it on all of
+    # the labeled data every INCREMENTAL_FULL_REFIT_INTERVAL training sets
+    INCREMENTAL_TRAINING_EPOCHS = 5
+    INCREMENTAL_FULL_REFIT_INTERVAL = 10
+    # Classifiers are given sparse tf-idf rows.  Those which need dense input
+    # (gnb) are given this many dense rows at a time
+    DENSE_CHUNK_SIZE = 1000
+    # Number of cores a training or cross validation task uses.  Tasks running at
+    # the same time on a host share TRAINING_CORES, a reservation is given up
+    # after TRAINING_CORES_TIMEOUT seconds if its task never releases it.  More
+    # jobs than free cores only add overhead, time it with benchmark_training first
+    TRAINING_N_JOBS = 1
+    TRAINING_CORES = os.cpu_count()
+    TRAINING_CORES_TIMEOUT = 3600
+    # Number of cross validation folds of the hyperparameter search
+    TUNING_CV_FOLDS = 3
+    # The search runs again once the labeled data is this many times larger than
+    # when the parameters were found
+    TUNING_LABEL_GROWTH = 2
+    # Predictions and uncertainties are written with COPY this many rows at a
+    # time, which bounds the memory used to write them
+    COPY_CHUNK_SIZE = 50000
+    # Unlabeled data is predicted and saved this many data at a time
+    PREDICTION_CHUNK_SIZE = 10000
+    # Save the predictions of a model as one DataPredictionSummary per datum,
+    # holding the probability of every label and the uncertainty, instead of a
+    # DataPrediction per label and a DataUncertainty.  Each model records the
+    # layout it predicted with, so the setting can be changed at any time
+    COMPACT_PREDICTIONS = False
+    # The predictions of superseded models are deleted this many rows at a
+    # time, so no delete holds its locks for long
+    PREDICTION_DELETE_BATCH_SIZE = 10000
+
     AUTH_USER_MODEL = 'auth.User'
 
     SITE_ID = 1
@@ -1,9 +1,13 @@
+import os
+import shutil
+
 from core.management.commands.seed import (SEED_PROJECT, SEED_USERNAME, SEED_EMAIL,
                                            SEED_PASSWORD, SEED_LABELS, SEED_USERNAME2,
                                            SEED_PASSWORD2)
 from core.pagination import SmartPagination
 from core.models import Profile, ProjectPermissions
 from core.utils.utils_queue import fill_queue
+from core.utils.utils_model import get_tfidf_path
 from test.util import read_test_data_api, compare_get_response
 
 
@@ -117,6 +121,13 @@ def test_download_model(seeded_database, client, admin_client, test_project_with
     assert 'detail' not in response
     assert response.get("Content-Type") == "application/x-zip-compressed"
 
+    # a project without a tf-idf matrix is downloaded without one
+    shutil.rmtree(os.path.realpath(get_tfidf_path(project.pk)))
+    os.remove(get_tfidf_path(project.pk))
+    response = admin_client.get('/api/download_model/' + str(project.pk) + '/')
+    assert response.status_code == 200
+    assert response.get("Content-Type") == "application/x-zip-compressed"
+
 
 def test_download_labeled_data(seeded_database, client, admin_client, test_project_labeled, test_queue_labeled, test_irr_queue_labeled, test_admin_queue_labeled):
     '''
@@ -394,6 +394,37 @@ def test_model_metrics(seeded_database, admin_client, client, test_project_unlab
             assert len(temp_dict['values']) == 2
 
 
+def test_model_run_stats(seeded_database, admin_client, client, test_project_unlabeled_and_tfidf, test_queue, test_admin_queue, test_irr_queue, test_labels):
+    '''
+    This tests the stage timings of the model runs
+    '''
+    project = test_project_unlabeled_and_tfidf
+    client_profile, admin_profile = sign_in_and_fill_queue(
+        project, test_queue, client, admin_client)
+
+    response = admin_client.get('/api/model_run_stats/' + str(project.pk) + '/').json()
+    assert response == []
+
+    # label 30 items. The model should run.
+    data = get_assignments(client_profile, project, 30)
+    for i in range(30):
+        response = client.post('/api/annotate_data/' + str(data[i].pk) + '/', {
+                               "labelID": test_labels[i % 3].pk, "labeling_time": 1
+                               })
+
+    response = admin_client.get('/api/model_run_stats/' + str(project.pk) + '/').json()
+    assert len(response) == 1
+    run = response[0]
+    assert run['model'] == Model.objects.get(project=project).pk
+    stages = {stage['name']: stage for stage in run['stages']}
+    assert set(stages) == {'load_features', 'load_labels', 'fit', 'save_model', 'load_model',
+                           'predict', 'save_predictions', 'fill_queue', 'cross_validation'}
+    assert stages['fit']['rows'] == 30
+    assert stages['save_predictions']['rows'] == DataPrediction.objects.filter(data__project=project).count()
+    assert all(stage['seconds'] >= 0 and stage['peak_memory'] > 0 for stage in run['stages'])
+    assert run['total_seconds'] >= stages['fit']['seconds']
+
+
 def test_coded_table(seeded_database, client, admin_client, test_project_data, test_queue, test_admin_queue, test_irr_queue, test_labels):
     '''
     This tests the table that displays the labeled table
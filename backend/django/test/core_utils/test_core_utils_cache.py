@@ -0,0 +1,72 @@
+import os
+import numpy as np
+
+from core.utils.utils_cache import get_cached, put_cached, invalidate_cached, estimate_size
+from core.utils.utils_model import (train_and_save_model, predict_data, load_cached_tfidf_matrix,
+                                    load_tfidf_matrix, save_tfidf_matrix)
+
+
+def test_get_cached(settings):
+    settings.ARTIFACT_CACHE_BYTES = 1000
+    loads = []
+
+    def load():
+        loads.append(1)
+        return np.zeros(50)
+
+    first = get_cached('test', -1, 'v1', load)
+    assert get_cached('test', -1, 'v1', load) is first
+    assert len(loads) == 1
+
+    # A new version replaces the old one
+    assert get_cached('test', -1, 'v2', load) is not first
+    assert len(loads) == 2
+
+    invalidate_cached(-1)
+    get_cached('test', -1, 'v2', load)
+    assert len(loads) == 3
+
+
+def test_put_cached_evicts_least_recently_used(settings):
+    settings.ARTIFACT_CACHE_BYTES = 1000
+    assert estimate_size(np.zeros(50)) == 400
+
+    put_cached('test', -1, 'v1', np.zeros(50))
+    put_cached('test', -2, 'v1', np.zeros(50))
+    # use the first so the second is the least recently used
+    get_cached('test', -1, 'v1', lambda: None)
+    put_cached('test', -3, 'v1', np.zeros(50))
+
+    assert get_cached('test', -1, 'v1', lambda: None) is not None
+    assert get_cached('test', -2, 'v1', lambda: None) is None
+    assert get_cached('test', -3, 'v1', lambda: None) is not None
+
+    # Artifacts larger than the cache are not kept
+    put_cached('test', -4, 'v1', np.zeros(1000))
+    assert get_cached('test', -4, 'v1', lambda: None) is None
+
+    for project_pk in (-1, -2, -3, -4):
+        invalidate_cached(project_pk)
+
+
+def test_predict_data_uses_cached_model(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir('model_pickles'))
+
+    model = train_and_save_model(project)
+    # the model trained by this worker is not read back from disk
+    os.remove(model.pickle_path)
+    predictions = predict_data(project, model)
+    assert len(predictions) == project.data_set.filter(
+        datalabel__isnull=True).count() * project.labels.count()
+
+
+def test_load_cached_tfidf_matrix(test_project_labeled_and_tfidf):
+    project = test_project_labeled_and_tfidf
+
+    tf_idf = load_cached_tfidf_matrix(project.pk)
+    assert load_cached_tfidf_matrix(project.pk) is tf_idf
+
+    # Saving a new version of the matrix invalidates it
+    save_tfidf_matrix(load_tfidf_matrix(project.pk), project.pk)
+    assert load_cached_tfidf_matrix(project.pk) is not tf_idf
@@ -1,27 +1,84 @@
 import pytest
 import os
+import pickle
+import glob
 import numpy as np
-
-from core.models import (Data, DataQueue, Model, DataLabel, DataPrediction,
-                         DataUncertainty, ProjectPermissions)
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.linear_model import SGDClassifier
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.naive_bayes import GaussianNB
+from sklearn.externals import joblib
+
+from core.models import (Data, DataQueue, Model, DataLabel, DataPrediction, TunedParameters,
+                         DataUncertainty, ProjectPermissions, TrainingSet)
 from core.utils.utils_annotate import assign_datum, label_data
+from core.utils.util import md5_hash
 from core.utils.utils_queue import fill_queue, find_queue_length
 from core.utils.utils_redis import get_ordered_data
-from core.utils.utils_model import (save_tfidf_matrix, load_tfidf_matrix,
+from core.utils.utils_stats import new_run_stats
+from core.utils.utils_model import (save_tfidf_matrix, load_tfidf_matrix, get_tfidf_rows,
+                                    get_tfidf_path, update_tfidf_matrix, create_tfidf_matrix,
+                                    update_hashing_matrix, iterate_corpus_chunks,
                                     train_and_save_model, predict_data,
+                                    update_model_incrementally, fit_classifier,
+                                    predict_classifier, cross_validate_classifier,
+                                    tune_hyperparameters, stratified_subsample,
+                                    prune_predictions, get_legacy_tfidf_path,
+                                    get_training_row_budget, get_calibration_folds,
+                                    compute_cv_metrics,
                                     least_confident, margin_sampling, entropy,
                                     check_and_trigger_model, cohens_kappa, fleiss_kappa)
 from test.util import assert_obj_exists, assert_redis_matches_db
 from test.conftest import TEST_QUEUE_LEN
 
 
-def test_create_tfidf_matrix(test_tfidf_matrix):
-    # UPDATE: is now saved as a dictionary of lists
-    assert isinstance(test_tfidf_matrix, dict)
-    assert len(test_tfidf_matrix) == 285
-    for key in test_tfidf_matrix:
-        assert len(test_tfidf_matrix[key]) == 307
-        assert np.all([type(val) == float for val in test_tfidf_matrix[key]])
+def test_create_tfidf_matrix(test_project_data, test_tfidf_matrix):
+    # UPDATE: is now saved as a CSR matrix with the data id of each row
+    matrix = test_tfidf_matrix['matrix']
+    assert isinstance(matrix, sparse.csr_matrix)
+    assert matrix.shape == (285, 307)
+    assert len(test_tfidf_matrix['data_ids']) == 285
+    assert len(test_tfidf_matrix['upload_ids']) == 285
+    assert set(test_tfidf_matrix['data_ids']) == set(
+        Data.objects.filter(project=test_project_data).values_list('pk', flat=True))
+
+
+def test_create_tfidf_matrix_parallel(test_project_data, settings):
+    serial_tf_idf, serial_vectorizer = create_tfidf_matrix(test_project_data.pk, workers=1)
+
+    settings.TFIDF_CHUNK_SIZE = 50
+    tf_idf, vectorizer = create_tfidf_matrix(test_project_data.pk, workers=2)
+
+    assert vectorizer.vocabulary_ == serial_vectorizer.vocabulary_
+    assert np.array_equal(tf_idf['data_ids'], serial_tf_idf['data_ids'])
+    assert np.array_equal(tf_idf['upload_ids'], serial_tf_idf['upload_ids'])
+    assert np.allclose(tf_idf['matrix'].toarray(), serial_tf_idf['matrix'].toarray())
+
+    texts = list(Data.objects.filter(project=test_project_data).values_list('text', flat=True)[:10])
+    assert np.allclose(vectorizer.transform(texts).toarray(),
+                       serial_vectorizer.transform(texts).toarray())
+
+
+def test_create_tfidf_matrix_float32(test_project_data, test_tfidf_matrix):
+    tf_idf, vectorizer = create_tfidf_matrix(test_project_data.pk, dtype=np.float32)
+
+    assert tf_idf['matrix'].dtype == np.float32
+    assert tf_idf['matrix'].data.nbytes * 2 == test_tfidf_matrix['matrix'].data.nbytes
+    assert np.allclose(tf_idf['matrix'].toarray(), test_tfidf_matrix['matrix'].toarray(), atol=1e-6)
+
+    texts = list(Data.objects.filter(project=test_project_data).values_list('text', flat=True)[:10])
+    assert vectorizer.transform(texts).dtype == np.float32
+
+
+def test_iterate_corpus_chunks(test_project_data):
+    project_data = Data.objects.filter(project=test_project_data)
+
+    chunks = list(iterate_corpus_chunks(project_data, chunk_size=100))
+
+    assert [len(chunk) for chunk in chunks] == [100, 100, 85]
+    assert [pk for chunk in chunks for pk, _, _ in chunk] == list(
+        project_data.order_by('upload_id_hash').values_list('pk', flat=True))
 
 
 def test_save_tfidf_matrix(test_project_data, test_tfidf_matrix, tmpdir, settings):
@@ -30,17 +87,187 @@ def test_save_tfidf_matrix(test_project_data, test_tfidf_matrix, tmpdir, setting
 
     file = save_tfidf_matrix(test_tfidf_matrix, test_project_data.pk)
 
-    assert os.path.isfile(file)
+    assert os.path.isdir(file)
     assert file == os.path.join(settings.TF_IDF_PATH, 'project_'
-                                + str(test_project_data.pk) + '_tfidf_matrix.pkl')
+                                + str(test_project_data.pk) + '_tfidf_matrix')
 
 
 def test_load_tfidf_matrix(test_project_labeled_and_tfidf, test_tfidf_matrix_labeled, tmpdir, settings):
-    matrix = load_tfidf_matrix(test_project_labeled_and_tfidf.pk)
+    tf_idf = load_tfidf_matrix(test_project_labeled_and_tfidf.pk)
+
+    assert np.array_equal(tf_idf['data_ids'], test_tfidf_matrix_labeled['data_ids'])
+    assert np.array_equal(tf_idf['upload_ids'], test_tfidf_matrix_labeled['upload_ids'])
+    assert np.allclose(tf_idf['matrix'].toarray(), test_tfidf_matrix_labeled['matrix'].toarray())
+
+
+def test_load_tfidf_matrix_legacy_pickle(test_project_data, test_tfidf_matrix, tmpdir, settings):
+    settings.TF_IDF_PATH = str(tmpdir.mkdir('data').mkdir('tf_idf'))
+    project = test_project_data
+    # matrices used to be pickled as a dict of upload_id to the dense row
+    dense = test_tfidf_matrix['matrix'].toarray()
+    legacy = dict(zip(test_tfidf_matrix['upload_ids'], dense.tolist()))
+    with open(get_legacy_tfidf_path(project.pk), 'wb') as legacy_file:
+        pickle.dump(legacy, legacy_file)
+
+    tf_idf = load_tfidf_matrix(project.pk)
+    assert not os.path.isfile(get_legacy_tfidf_path(project.pk))
+    assert os.path.isdir(get_tfidf_path(project.pk))
+    for data_id, upload_id in zip(tf_idf['data_ids'], tf_idf['upload_ids']):
+        assert Data.objects.get(pk=data_id).upload_id == upload_id
+    assert np.allclose(get_tfidf_rows(tf_idf, list(test_tfidf_matrix['data_ids'])).toarray(), dense)
+
 
-    for key in matrix:
-        assert key in test_tfidf_matrix_labeled
-        assert np.allclose(matrix[key], test_tfidf_matrix_labeled[key])
+def test_load_tfidf_matrix_memory_mapped(test_project_labeled_and_tfidf):
+    tf_idf = load_tfidf_matrix(test_project_labeled_and_tfidf.pk)
+
+    assert isinstance(tf_idf['data_ids'], np.memmap)
+    assert not tf_idf['matrix'].data.flags.writeable
+
+    tf_idf = load_tfidf_matrix(test_project_labeled_and_tfidf.pk, mmap=False)
+
+    assert not isinstance(tf_idf['data_ids'], np.memmap)
+
+
+def test_save_tfidf_matrix_new_version(test_project_labeled_and_tfidf, test_tfidf_matrix_labeled):
+    project = test_project_labeled_and_tfidf
+    loaded = load_tfidf_matrix(project.pk)
+
+    for i in range(3):
+        save_tfidf_matrix(test_tfidf_matrix_labeled, project.pk)
+
+    fpath = get_tfidf_path(project.pk)
+    assert os.path.islink(fpath)
+    # Only the current and previous versions are kept
+    assert len(glob.glob(fpath + '_*[0-9]')) == 2
+    # A matrix loaded before the new versions were saved can still be read
+    assert np.allclose(loaded['matrix'].toarray(), test_tfidf_matrix_labeled['matrix'].toarray())
+
+
+def test_get_tfidf_rows(test_project_labeled_and_tfidf, test_tfidf_matrix_labeled):
+    tf_idf = load_tfidf_matrix(test_project_labeled_and_tfidf.pk)
+    data_ids = tf_idf['data_ids'].tolist()
+    picked = [data_ids[5], data_ids[0], data_ids[17]]
+
+    rows = get_tfidf_rows(tf_idf, picked)
+
+    assert rows.shape == (3, tf_idf['matrix'].shape[1])
+    for i, row in enumerate([5, 0, 17]):
+        assert np.allclose(rows[i].toarray(), test_tfidf_matrix_labeled['matrix'][row].toarray())
+
+    # The row index is saved with the matrix
+    assert np.array_equal(tf_idf['index_ids'], np.sort(tf_idf['data_ids']))
+    assert np.array_equal(tf_idf['data_ids'][tf_idf['index_rows']], tf_idf['index_ids'])
+
+    with pytest.raises(ValueError):
+        get_tfidf_rows(tf_idf, [max(data_ids) + 1])
+
+
+def add_new_data(project, texts):
+    new_data = []
+    for i, text in enumerate(texts):
+        upload_id = 'new_' + str(i)
+        new_data.append(Data.objects.create(text=text, hash=md5_hash(text), project=project,
+                                            upload_id=upload_id, upload_id_hash=md5_hash(upload_id)))
+    return new_data
+
+
+def test_update_tfidf_matrix(test_project_labeled_and_tfidf, test_tfidf_matrix_labeled,
+                             test_tfidf_vectorizer_labeled, settings):
+    project = test_project_labeled_and_tfidf
+    settings.TFIDF_REFIT_MIN_COVERAGE = 0
+    texts = ['Feminism is about equality for everyone #SemST',
+             'Women deserve equal pay for equal work #SemST']
+    new_data = add_new_data(project, texts)
+
+    tf_idf = update_tfidf_matrix(project.pk)
+
+    num_rows = len(test_tfidf_matrix_labeled['data_ids'])
+    assert tf_idf['matrix'].shape == (num_rows + 2, test_tfidf_matrix_labeled['matrix'].shape[1])
+    assert set(tf_idf['data_ids'][num_rows:]) == set(d.pk for d in new_data)
+    assert np.allclose(tf_idf['matrix'][:num_rows].toarray(),
+                       test_tfidf_matrix_labeled['matrix'].toarray())
+
+    rows = get_tfidf_rows(tf_idf, [d.pk for d in new_data])
+    assert np.allclose(rows.toarray(), test_tfidf_vectorizer_labeled.transform(texts).toarray())
+
+
+def test_update_tfidf_matrix_refit(test_project_labeled_and_tfidf, settings):
+    project = test_project_labeled_and_tfidf
+    add_new_data(project, ['Feminism is about equality for everyone #SemST'])
+
+    settings.TFIDF_REFIT_ROW_GROWTH = 0
+    assert update_tfidf_matrix(project.pk) is None
+
+    # New data which matches none of the vocabulary
+    settings.TFIDF_REFIT_ROW_GROWTH = 0.5
+    settings.TFIDF_REFIT_MIN_COVERAGE = 0.8
+    add_new_data(project, ['zzzz qqqq', 'xxxx yyyy'])
+    assert update_tfidf_matrix(project.pk) is None
+
+
+def test_update_tfidf_matrix_cumulative_growth(test_project_labeled_and_tfidf, settings):
+    project = test_project_labeled_and_tfidf
+    settings.TFIDF_REFIT_ROW_GROWTH = 0.5
+    settings.TFIDF_REFIT_MIN_COVERAGE = 0
+    num_rows = len(load_tfidf_matrix(project.pk)['data_ids'])
+    num_upload = int(num_rows * 0.4)
+
+    add_new_data(project, ['Feminism is about equality for everyone #SemST ' + str(i)
+                           for i in range(num_upload)])
+    tf_idf = update_tfidf_matrix(project.pk)
+    assert tf_idf['meta']['fit_rows'] == num_rows
+    save_tfidf_matrix(tf_idf, project.pk)
+
+    # The second upload is small compared to the matrix, but the two together
+    # grow the data of the last fit by 80%
+    add_new_data(project, ['Women deserve equal pay for equal work #SemST ' + str(i)
+                           for i in range(num_upload)])
+    assert update_tfidf_matrix(project.pk) is None
+
+
+def test_update_hashing_matrix(test_project_data, tmpdir, settings):
+    settings.TF_IDF_PATH = str(tmpdir.mkdir('tf_idf'))
+    settings.HASHING_N_FEATURES = 2 ** 10
+    project = test_project_data
+    project.featurizer = 'hashing'
+    project.save()
+
+    tf_idf = update_hashing_matrix(project.pk)
+
+    assert tf_idf['meta']['featurizer'] == 'hashing'
+    assert tf_idf['matrix'].shape == (285, 2 ** 10)
+    save_tfidf_matrix(tf_idf, project.pk)
+
+    add_new_data(project, ['Feminism is about equality for everyone #SemST',
+                           'Women deserve equal pay for equal work #SemST'])
+    tf_idf = update_hashing_matrix(project.pk)
+
+    assert tf_idf['matrix'].shape == (287, 2 ** 10)
+    assert np.array_equal(tf_idf['doc_freq'],
+                          np.bincount(tf_idf['matrix'].indices, minlength=2 ** 10))
+
+    # The rows are weighted the same way a TfidfTransformer fit on all data would
+    rows = get_tfidf_rows(tf_idf, tf_idf['data_ids'].tolist())
+    expected = TfidfTransformer().fit(tf_idf['matrix']).transform(tf_idf['matrix'])
+    assert np.allclose(rows.toarray(), expected.toarray())
+
+
+def test_update_hashing_matrix_parallel(test_project_data, tmpdir, settings):
+    settings.TF_IDF_PATH = str(tmpdir.mkdir('tf_idf'))
+    settings.HASHING_N_FEATURES = 2 ** 10
+    project = test_project_data
+    project.featurizer = 'hashing'
+    project.save()
+
+    serial_tf_idf = update_hashing_matrix(project.pk, workers=1)
+
+    settings.TFIDF_CHUNK_SIZE = 50
+    tf_idf = update_hashing_matrix(project.pk, workers=2)
+
+    assert np.array_equal(tf_idf['data_ids'], serial_tf_idf['data_ids'])
+    assert np.array_equal(tf_idf['upload_ids'], serial_tf_idf['upload_ids'])
+    assert np.array_equal(tf_idf['doc_freq'], serial_tf_idf['doc_freq'])
+    assert np.allclose(tf_idf['matrix'].toarray(), serial_tf_idf['matrix'].toarray())
 
 
 def test_least_confident_notarray():
@@ -157,6 +384,18 @@ def test_entropy_with_zero():
     np.testing.assert_almost_equal(e, 0.26529499557412151)
 
 
+def test_uncertainty_matrix():
+    probs = np.array([[0.1, 0.3, 0.6],
+                      [0, 0.3, 0.7],
+                      [0.1, 0.1, 0.8]])
+
+    np.testing.assert_almost_equal(least_confident(probs), [least_confident(row) for row in probs])
+    np.testing.assert_almost_equal(margin_sampling(probs), [margin_sampling(row) for row in probs])
+    np.testing.assert_almost_equal(entropy(probs), [entropy(row) for row in probs])
+    # the probabilities are not sorted in place
+    assert probs[0].tolist() == [0.1, 0.3, 0.6]
+
+
 def test_train_and_save_model(test_project_labeled_and_tfidf, tmpdir, settings):
     project = test_project_labeled_and_tfidf
 
@@ -175,6 +414,270 @@ def test_train_and_save_model(test_project_labeled_and_tfidf, tmpdir, settings):
                                              + '_training_'
                                              + str(project.get_current_training_set().set_number)
                                              + '.pkl')
+    # Cross validation runs later in its own task
+    assert model.cv_accuracy is None
+
+
+def test_train_and_save_model_incremental(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    project.incremental_training = True
+    project.save()
+
+    model_path_temp = tmpdir.listdir()[0].mkdir('model_pickles')
+    settings.MODEL_PICKLE_PATH = str(model_path_temp)
+
+    model = train_and_save_model(project)
+    assert isinstance(joblib.load(model.pickle_path), SGDClassifier)
+    assert model.feature_version == load_tfidf_matrix(project.pk)['meta']['feature_version']
+    assert model.last_label_pk == DataLabel.objects.filter(data__project=project).latest('pk').pk
+
+    # Label more data in the next training set
+    training_set = TrainingSet.objects.create(
+        project=project, set_number=project.get_current_training_set().set_number + 1)
+    labels = list(project.labels.all())
+    for i, datum in enumerate(project.data_set.filter(datalabel__isnull=True)[:6]):
+        DataLabel.objects.create(data=datum, profile=project.creator,
+                                 label=labels[i % len(labels)], training_set=training_set)
+    all_labels = list(DataLabel.objects.filter(data__project=project).values_list('label', flat=True))
+    tf_idf = load_tfidf_matrix(project.pk)
+
+    settings.INCREMENTAL_FULL_REFIT_INTERVAL = 10
+    clf = update_model_incrementally(project, tf_idf, training_set, all_labels)
+    assert isinstance(clf, SGDClassifier)
+
+    # Full refits
+    settings.INCREMENTAL_FULL_REFIT_INTERVAL = 1
+    assert update_model_incrementally(project, tf_idf, training_set, all_labels) is None
+    settings.INCREMENTAL_FULL_REFIT_INTERVAL = 10
+    tf_idf['meta']['feature_version'] = 'refit'
+    assert update_model_incrementally(project, tf_idf, training_set, all_labels) is None
+
+    model = train_and_save_model(project)
+    assert model.training_set == training_set
+
+
+def test_update_model_incrementally_late_labels(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    project.incremental_training = True
+    project.save()
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir('model_pickles'))
+    settings.INCREMENTAL_FULL_REFIT_INTERVAL = 10
+
+    model = train_and_save_model(project)
+    # Labeled while the model predicted, before the next training set was created
+    trained_set = project.get_current_training_set()
+    labels = list(project.labels.all())
+    late = [DataLabel.objects.create(data=datum, profile=project.creator, label=labels[i % len(labels)],
+                                     training_set=trained_set)
+            for i, datum in enumerate(project.data_set.filter(datalabel__isnull=True)[:3])]
+    training_set = TrainingSet.objects.create(project=project, set_number=trained_set.set_number + 1)
+
+    tf_idf = load_tfidf_matrix(project.pk)
+    all_labels = list(DataLabel.objects.filter(data__project=project).values_list('label', flat=True))
+    previous = joblib.load(model.pickle_path)
+    clf = update_model_incrementally(project, tf_idf, training_set, all_labels, late[-1].pk)
+    # the late labels were trained on
+    assert not np.allclose(clf.coef_, previous.coef_)
+
+    # labels after the mark of the current model are not
+    clf = update_model_incrementally(project, tf_idf, training_set, all_labels, model.last_label_pk)
+    assert np.allclose(clf.coef_, previous.coef_)
+
+
+def test_fit_classifier_dense_chunks(settings):
+    settings.DENSE_CHUNK_SIZE = 3
+    X = sparse.random(20, 10, density=0.3, format='csr', random_state=0)
+    Y = np.array([0, 1] * 10)
+
+    clf = fit_classifier(GaussianNB(), X, Y)
+    dense_clf = GaussianNB().fit(X.toarray(), Y)
+    assert np.allclose(clf.theta_, dense_clf.theta_)
+
+    probabilities = predict_classifier(clf, X)
+    assert probabilities.shape == (20, 2)
+    assert np.array_equal(probabilities.argmax(axis=1),
+                          dense_clf.predict_proba(X.toarray()).argmax(axis=1))
+
+    predictions = cross_validate_classifier(GaussianNB(), X, Y)
+    assert len(predictions) == 20
+    assert set(predictions) <= {0, 1}
+
+
+def test_train_and_save_model_linear_svm(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    project.classifier = 'linear svm'
+    project.save()
+
+    model_path_temp = tmpdir.listdir()[0].mkdir('model_pickles')
+    settings.MODEL_PICKLE_PATH = str(model_path_temp)
+
+    model = train_and_save_model(project)
+    clf = joblib.load(model.pickle_path)
+    assert isinstance(clf, CalibratedClassifierCV)
+
+    predictions = predict_data(project, model)
+    assert len(predictions) == project.data_set.filter(
+        datalabel__isnull=True).count() * project.labels.count()
+    probabilities = [p.predicted_probability for p in predictions]
+    assert np.allclose(np.array(probabilities).reshape(-1, project.labels.count()).sum(axis=1), 1)
+
+
+def test_get_calibration_folds():
+    assert get_calibration_folds([1] * 10 + [2] * 10) == 3
+    assert get_calibration_folds([1] * 10 + [2] * 2) == 2
+    assert get_calibration_folds([1] * 10 + [2]) == 1
+
+
+def test_train_and_save_model_linear_svm_rare_label(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    project.classifier = 'linear svm'
+    project.save()
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir('model_pickles'))
+
+    # a label with a single example can not fill three calibration folds
+    rare_labels = DataLabel.objects.filter(data__project=project, label=project.labels.first())
+    rare_labels.exclude(pk=rare_labels.first().pk).delete()
+
+    model = train_and_save_model(project)
+    predictions = predict_data(project, model)
+    probabilities = [p.predicted_probability for p in predictions]
+    assert np.allclose(np.array(probabilities).reshape(-1, project.labels.count()).sum(axis=1), 1)
+
+    # the folds of the cross validation are calibrated the same way
+    model = compute_cv_metrics(model)
+    assert model.cv_accuracy is not None
+
+    # with two examples it is calibrated over two folds
+    datum = project.data_set.filter(datalabel__isnull=True).first()
+    DataLabel.objects.create(data=datum, profile=project.creator, label=project.labels.first(),
+                             training_set=project.get_current_training_set())
+    TrainingSet.objects.create(project=project,
+                               set_number=project.get_current_training_set().set_number + 1)
+    model = train_and_save_model(project)
+    assert joblib.load(model.pickle_path).cv == 2
+    assert compute_cv_metrics(model).cv_accuracy is not None
+
+
+def test_tune_hyperparameters(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    project.tune_hyperparameters = True
+    project.save()
+
+    tuned = tune_hyperparameters(project)
+    assert tuned.estimator == 'LogisticRegression'
+    assert tuned.feature_version == load_tfidf_matrix(project.pk)['meta']['feature_version']
+    assert set(tuned.parameters) == {'C'}
+    assert tuned.num_labels == DataLabel.objects.filter(data__project=project).count()
+
+    # The parameters are reused without searching again
+    assert tune_hyperparameters(project).timestamp == tuned.timestamp
+    assert TunedParameters.objects.filter(project=project).count() == 1
+
+    # until the labeled data has grown enough since the search
+    TunedParameters.objects.filter(pk=tuned.pk).update(num_labels=tuned.num_labels // 2)
+    assert tune_hyperparameters(project).num_labels == tuned.num_labels
+    assert TunedParameters.objects.filter(project=project).count() == 1
+
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir('model_pickles'))
+    model = train_and_save_model(project)
+    assert joblib.load(model.pickle_path).C == tuned.parameters['C']
+    assert model.run_stats['parameters'] == tuned.parameters
+
+
+def test_tune_hyperparameters_linear_svm_rare_label(test_project_labeled_and_tfidf, settings):
+    project = test_project_labeled_and_tfidf
+    project.classifier = 'linear svm'
+    project.tune_hyperparameters = True
+    project.save()
+    settings.TUNING_CV_FOLDS = 3
+
+    # each search fold is fit on two of the three examples of the rare label,
+    # too few for three calibration folds
+    rare_labels = DataLabel.objects.filter(data__project=project, label=project.labels.first())
+    rare_labels.exclude(pk__in=list(rare_labels.values_list('pk', flat=True)[:3])).delete()
+
+    tuned = tune_hyperparameters(project)
+    assert tuned.estimator == 'CalibratedClassifierCV'
+    assert set(tuned.parameters) == {'base_estimator__C'}
+
+    # a search fold with a single example of a label can not be calibrated
+    TunedParameters.objects.all().delete()
+    rare_labels.exclude(pk__in=list(rare_labels.values_list('pk', flat=True)[:2])).delete()
+    assert tune_hyperparameters(project) is None
+
+
+def test_stratified_subsample():
+    labels = [1] * 70 + [2] * 29 + [3]
+    rows = stratified_subsample(labels, 10, 1)
+
+    assert list(rows) == sorted(set(rows))
+    kept = [labels[i] for i in rows]
+    assert (kept.count(1), kept.count(2), kept.count(3)) == (7, 2, 1)
+    # The same seed draws the same sample
+    assert list(stratified_subsample(labels, 10, 1)) == list(rows)
+    assert len(stratified_subsample(labels, 200, 1)) == len(labels)
+
+
+def test_train_and_save_model_subsample(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir('model_pickles'))
+
+    model = train_and_save_model(project)
+    assert model.training_strategy == 'full'
+    assert model.training_rows == project.labeled_data_count()
+
+    project.training_max_rows = model.training_rows // 2
+    project.save()
+    TrainingSet.objects.create(project=project,
+                               set_number=project.get_current_training_set().set_number + 1)
+    model = train_and_save_model(project)
+    assert model.training_strategy == 'subsample'
+    assert model.training_rows <= project.training_max_rows + project.labels.count()
+    assert model.run_stats['training_strategy'] == 'subsample'
+    assert [s['rows'] for s in model.run_stats['stages'] if s['name'] == 'fit'] == [model.training_rows]
+
+    assert model.training_budget == project.training_max_rows
+
+    # Labels added after the model was fit do not change the cross validated sample
+    labels = list(project.labels.all())
+    for i, datum in enumerate(project.data_set.filter(datalabel__isnull=True)[:5]):
+        DataLabel.objects.create(data=datum, profile=project.creator, label=labels[i % len(labels)],
+                                 training_set=project.get_current_training_set())
+    model = compute_cv_metrics(model)
+    assert model.cv_accuracy is not None
+    assert [s['rows'] for s in model.run_stats['stages'] if s['name'] == 'cross_validation'] == [
+        model.training_rows]
+
+
+def test_get_training_row_budget(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir('model_pickles'))
+    assert get_training_row_budget(project) is None
+
+    # No time budget can be estimated before a model was fit
+    project.training_max_seconds = 1
+    assert get_training_row_budget(project) is None
+
+    model = train_and_save_model(project)
+    num_labeled = model.training_rows
+    model.run_stats['stages'] = [{'name': 'fit', 'rows': num_labeled, 'seconds': 2.0}]
+    model.save()
+
+    # logistic regression fit time grows linearly with the rows
+    assert get_training_row_budget(project) == int(num_labeled / 2)
+    project.classifier = 'svm'
+    assert get_training_row_budget(project) == int(num_labeled * 0.5 ** 0.5)
+    project.training_max_rows = 10
+    assert get_training_row_budget(project) == 10
+
+    project.classifier = 'logistic regression'
+    project.training_max_rows = None
+    project.save()
+    TrainingSet.objects.create(project=project,
+                               set_number=project.get_current_training_set().set_number + 1)
+    model = train_and_save_model(project)
+    assert model.training_strategy == 'subsample'
+    assert model.training_budget == int(num_labeled / 2)
 
 
 def test_predict_data(test_project_with_trained_model, tmpdir):
@@ -197,6 +700,104 @@ def test_predict_data(test_project_with_trained_model, tmpdir):
         })
 
 
+def test_predict_data_copy_chunks(test_project_with_trained_model, settings):
+    project = test_project_with_trained_model
+    model = project.model_set.get()
+    # write in many small COPY chunks
+    settings.COPY_CHUNK_SIZE = 7
+
+    predictions = predict_data(project, model)
+    num_unlabeled = project.data_set.filter(datalabel__isnull=True).count()
+    assert predictions.count() == num_unlabeled * project.labels.count()
+    assert DataUncertainty.objects.filter(model=model).count() == num_unlabeled
+
+    for uncertainty in DataUncertainty.objects.filter(model=model):
+        probs = np.array(list(DataPrediction.objects.filter(
+            model=model, data=uncertainty.data).values_list('predicted_probability', flat=True)))
+        np.testing.assert_almost_equal(uncertainty.least_confident, least_confident(probs))
+        np.testing.assert_almost_equal(uncertainty.entropy, entropy(probs))
+
+
+def test_predict_data_blocks(test_project_with_trained_model, settings):
+    project = test_project_with_trained_model
+    model = project.model_set.get()
+    settings.PREDICTION_CHUNK_SIZE = 10
+    stats = new_run_stats()
+
+    predictions = predict_data(project, model, stats)
+    num_unlabeled = project.data_set.filter(datalabel__isnull=True).count()
+    assert num_unlabeled > settings.PREDICTION_CHUNK_SIZE
+    assert predictions.count() == num_unlabeled * project.labels.count()
+    assert DataUncertainty.objects.filter(model=model).count() == num_unlabeled
+
+    # the stages of each block are added up
+    stages = {stage['name']: stage for stage in stats['stages']}
+    assert len(stats['stages']) == 3
+    assert stages['predict']['rows'] == num_unlabeled
+    assert stages['save_predictions']['rows'] == predictions.count()
+
+
+def test_predict_data_compact(test_project_with_trained_model, test_queue, test_redis, settings):
+    project = test_project_with_trained_model
+    model = project.model_set.get()
+    settings.COMPACT_PREDICTIONS = True
+
+    summaries = predict_data(project, model)
+    num_unlabeled = project.data_set.filter(datalabel__isnull=True).count()
+    assert summaries.count() == num_unlabeled
+    assert not DataPrediction.objects.filter(model=model).exists()
+    assert not DataUncertainty.objects.filter(model=model).exists()
+
+    for summary in summaries:
+        probs = np.array(summary.probabilities)
+        assert len(probs) == len(model.label_order) == project.labels.count()
+        np.testing.assert_almost_equal(probs.sum(), 1)
+        assert summary.predicted_label_id == model.label_order[probs.argmax()]
+        np.testing.assert_almost_equal(summary.max_probability, probs.max())
+        np.testing.assert_almost_equal(summary.least_confident, least_confident(probs))
+
+    # The queue is filled by the uncertainty in the summaries, which the model
+    # records it saved even after the setting is turned off
+    settings.COMPACT_PREDICTIONS = False
+    model.refresh_from_db()
+    assert model.compact_predictions
+    fill_queue(test_queue, 'least confident')
+    data_list = get_ordered_data(test_queue.data.all(), 'least confident')
+    previous_lc = data_list[0].datapredictionsummary_set.get().least_confident
+    for datum in data_list:
+        assert datum.datapredictionsummary_set.get().least_confident <= previous_lc
+        previous_lc = datum.datapredictionsummary_set.get().least_confident
+
+
+def test_prune_predictions(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir('model_pickles'))
+    settings.PREDICTION_DELETE_BATCH_SIZE = 7
+
+    models = []
+    for _ in range(3):
+        models.append(train_and_save_model(project))
+        predict_data(project, models[-1])
+        TrainingSet.objects.create(project=project,
+                                   set_number=project.get_current_training_set().set_number + 1)
+
+    project.prediction_keep_last = None
+    assert prune_predictions(project) == 0
+
+    num_predictions = DataPrediction.objects.filter(model=models[0]).count()
+    num_uncertainties = DataUncertainty.objects.filter(model=models[0]).count()
+    project.prediction_keep_last = 1
+    assert prune_predictions(project) == 2 * (num_predictions + num_uncertainties)
+
+    for model in models[:2]:
+        assert not DataPrediction.objects.filter(model=model).exists()
+        assert not DataUncertainty.objects.filter(model=model).exists()
+    assert DataPrediction.objects.filter(model=models[2]).count() == num_predictions
+    assert DataUncertainty.objects.filter(model=models[2]).count() == num_uncertainties
+    # the models themselves are kept
+    assert Model.objects.filter(project=project).count() == 3
+
+
 def test_check_and_trigger_model_first_labeled(setup_celery, test_project_data, test_labels, test_queue, test_profile):
     initial_training_set = test_project_data.get_current_training_set()
 
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from core.models import Data, DataQueue, NearDuplicateBucket, NearDuplicateSignature
+from core.utils.util import add_data, upload_data
+from core.utils.utils_queue import add_queue, fill_queue
+from core.utils.utils_near_duplicates import (minhash_signatures, lsh_buckets,
+                                              collapse_near_duplicates)
+
+TEXT = "Wonder what it'd be like to wear a dress and NOT be sexually harassed for it. #YesAllWomen"
+RETWEET = "RT @jess: " + TEXT
+OTHER_TEXT = "Women deserve equal pay for equal work, it is not that complicated #SemST"
+
+
+def test_minhash_signatures():
+    signatures = minhash_signatures([TEXT, RETWEET, OTHER_TEXT])
+
+    assert np.mean(signatures[0] == signatures[1]) >= 0.8
+    assert np.mean(signatures[0] == signatures[2]) < 0.2
+
+    buckets = lsh_buckets(signatures)
+    assert buckets.dtype == np.int64
+    assert len(set(buckets[0]) & set(buckets[1])) > 0
+
+
+def test_collapse_near_duplicates(db, test_project):
+    test_project.collapse_near_duplicates = True
+    test_project.save()
+
+    add_data(test_project, pd.DataFrame({'Text': [TEXT, OTHER_TEXT, RETWEET],
+                                         'Label': [None, None, None]}))
+    assert collapse_near_duplicates(test_project) == 1
+
+    original = Data.objects.get(project=test_project, text=TEXT)
+    assert original.representative is None
+    assert Data.objects.get(project=test_project, text=OTHER_TEXT).representative is None
+    assert Data.objects.get(project=test_project, text=RETWEET).representative == original
+
+    # Only representatives are indexed,
+    assert set(NearDuplicateBucket.objects.filter(project=test_project).values_list(
+        'data__text', flat=True)) == {TEXT, OTHER_TEXT}
+    # with their signatures, so their text is not hashed again
+    assert NearDuplicateSignature.objects.filter(data__project=test_project).count() == 2
+    for signature in NearDuplicateSignature.objects.filter(data__project=test_project):
+        assert signature.signature == minhash_signatures([signature.data.text])[0].tolist()
+    # Data already compared are not compared again
+    assert collapse_near_duplicates(test_project) == 0
+
+    # A later upload is compared against the data already in the project
+    add_data(test_project, pd.DataFrame({'Text': [TEXT + ' http://t.co/abc'], 'Label': [None]}))
+    assert collapse_near_duplicates(test_project) == 1
+    assert Data.objects.get(project=test_project,
+                            text=TEXT + ' http://t.co/abc').representative == original
+
+
+def test_add_data_keeps_near_duplicates(db, test_project):
+    add_data(test_project, pd.DataFrame({'Text': [TEXT, RETWEET], 'Label': [None, None]}))
+
+    assert Data.objects.filter(project=test_project, representative=None).count() == 2
+    assert not NearDuplicateBucket.objects.filter(project=test_project).exists()
+
+
+def test_upload_data_collapses_before_first_fill(db, test_project, test_redis):
+    # The upload tasks only run once the request commits, so this is the queue the
+    # user sees after creating the project, before any worker picked up the tasks
+    test_project.collapse_near_duplicates = True
+    test_project.save()
+    queue = add_queue(test_project, 10)
+    irr_queue = add_queue(test_project, 10, type="irr")
+
+    upload_data(pd.DataFrame({'Text': [TEXT, OTHER_TEXT, RETWEET], 'Label': [None, None, None]}),
+                test_project, queue, irr_queue, batch_size=10)
+
+    assert Data.objects.get(project=test_project, text=RETWEET).representative is not None
+    assert set(DataQueue.objects.filter(queue__project=test_project).values_list(
+        'data__text', flat=True)) == {TEXT, OTHER_TEXT}
+
+
+def test_fill_queue_skips_uncompared_data(db, test_project, test_redis):
+    test_project.collapse_near_duplicates = True
+    test_project.save()
+    queue = add_queue(test_project, 10)
+    add_data(test_project, pd.DataFrame({'Text': [TEXT], 'Label': [None]}))
+    collapse_near_duplicates(test_project)
+
+    # Data uploaded to an existing project are queued once their near duplicates
+    # are collapsed by the upload tasks
+    upload_data(pd.DataFrame({'Text': [RETWEET, OTHER_TEXT], 'Label': [None, None]}), test_project)
+    assert fill_queue(queue, orderby='random') == 1
+    assert DataQueue.objects.get(queue=queue).data.text == TEXT
+
+    collapse_near_duplicates(test_project)
+    assert fill_queue(queue, orderby='random') == 1
+    assert set(DataQueue.objects.filter(queue=queue).values_list(
+        'data__text', flat=True)) == {TEXT, OTHER_TEXT}
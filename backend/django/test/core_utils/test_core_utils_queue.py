@@ -61,9 +61,12 @@ def test_fill_queue_all_remaining_data(db, test_queue):
     test_queue.length = all_data_count + 1
     test_queue.save()
 
-    fill_queue(test_queue, orderby='random')
+    assert fill_queue(test_queue, orderby='random') == all_data_count
     assert test_queue.data.count() == all_data_count
 
+    # a full queue has nothing added
+    assert fill_queue(test_queue, orderby='random') == 0
+
 
 def test_fill_multiple_projects(db, test_queue, test_profile):
     project_data_count = test_queue.project.data_set.count()
@@ -2,7 +2,8 @@ from core.models import AssignedData, DataQueue, Queue, Data
 from core.utils.util import add_data, create_project
 from core.utils.utils_redis import (redis_serialize_queue, redis_serialize_data,
                                     redis_serialize_set, redis_parse_queue, redis_parse_data,
-                                    redis_parse_list_dataids, init_redis)
+                                    redis_parse_list_dataids, init_redis,
+                                    redis_serialize_cores, reserve_training_cores)
 from core.utils.utils_queue import add_queue, fill_queue
 from test.util import read_test_data_backend, assert_obj_exists, assert_redis_matches_db
 
@@ -130,3 +131,30 @@ def test_init_redis_ignores_assigned_data(db, test_profile, test_queue, test_red
     # Make sure the assigned datum didn't get into the redis queue
     assert test_redis.llen('queue:' + str(test_queue.pk)) == test_queue.length - 1
     assert test_redis.scard('set:' + str(test_queue.pk)) == test_queue.length - 1
+
+
+def test_reserve_training_cores(test_redis, settings):
+    settings.TRAINING_CORES = 4
+
+    with reserve_training_cores(3) as first:
+        assert first == 3
+        with reserve_training_cores(3) as second:
+            # Only one core is left, but every task gets at least one
+            assert second == 1
+            with reserve_training_cores(2) as third:
+                assert third == 1
+        assert test_redis.zcard(redis_serialize_cores()) == 1
+
+    assert test_redis.zcard(redis_serialize_cores()) == 0
+    with reserve_training_cores(8) as n_jobs:
+        assert n_jobs == 4
+
+
+def test_reserve_training_cores_expired(test_redis, settings):
+    settings.TRAINING_CORES = 4
+    settings.TRAINING_CORES_TIMEOUT = -1
+
+    # A reservation which was never released no longer counts once it expires
+    with reserve_training_cores(4):
+        with reserve_training_cores(4) as n_jobs:
+            assert n_jobs == 4
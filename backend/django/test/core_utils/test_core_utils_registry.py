@@ -0,0 +1,76 @@
+import pytest
+import os
+import numpy as np
+
+from core.models import Model, TrainingSet
+from core.utils.utils_model import train_and_save_model
+from core.utils.utils_registry import (get_metadata_path, load_model_metadata, load_model_artifact,
+                                       prune_model_artifacts, verify_model_artifact)
+
+
+def test_train_and_save_model_metadata(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir('model_pickles'))
+
+    model = train_and_save_model(project)
+
+    assert os.path.isfile(get_metadata_path(model.pickle_path))
+    metadata = load_model_metadata(model.pickle_path)
+    assert metadata['classifier'] == project.classifier
+    assert metadata['training_size'] == project.labeled_data_count()
+    assert metadata['compression'] == settings.MODEL_COMPRESSION
+    assert metadata['size'] == os.path.getsize(model.pickle_path)
+    assert 'fit' in metadata['timings']
+
+    clf = load_model_artifact(model)
+    assert sorted(clf.classes_) == sorted(project.labels.values_list('pk', flat=True))
+
+    # Only temporary files are moved into place
+    assert sorted(os.listdir(settings.MODEL_PICKLE_PATH)) == sorted(
+        [os.path.basename(model.pickle_path), os.path.basename(get_metadata_path(model.pickle_path))])
+
+
+def test_load_model_artifact_checksum(test_project_labeled_and_tfidf, tmpdir, settings):
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir('model_pickles'))
+    model = train_and_save_model(test_project_labeled_and_tfidf)
+
+    with open(model.pickle_path, 'ab') as f:
+        f.write(b'corrupt')
+
+    assert not verify_model_artifact(model.pickle_path)
+    with pytest.raises(ValueError):
+        load_model_artifact(model, verify=True)
+
+
+def test_load_model_artifact_mmap(test_project_labeled_and_tfidf, tmpdir, settings):
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir('model_pickles'))
+    settings.MODEL_COMPRESSION = 0
+    model = train_and_save_model(test_project_labeled_and_tfidf)
+
+    clf = load_model_artifact(model, mmap=True)
+    assert isinstance(clf.coef_, np.memmap)
+    assert not isinstance(load_model_artifact(model).coef_, np.memmap)
+
+
+def test_prune_model_artifacts(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir('model_pickles'))
+    settings.MODEL_KEEP_LAST = None
+
+    models = []
+    for _ in range(4):
+        models.append(train_and_save_model(project))
+        TrainingSet.objects.create(project=project,
+                                   set_number=project.get_current_training_set().set_number + 1)
+    assert all(os.path.isfile(model.pickle_path) for model in models)
+
+    settings.MODEL_KEEP_LAST = 2
+    assert prune_model_artifacts(project) == 2
+
+    for model in models[:2]:
+        assert not os.path.isfile(model.pickle_path)
+        assert not os.path.isfile(get_metadata_path(model.pickle_path))
+    for model in models[2:]:
+        assert os.path.isfile(model.pickle_path)
+    # the models stay, their predictions refer to them
+    assert Model.objects.filter(project=project).count() == 4
@@ -1,10 +1,13 @@
 import os
 import random
+import numpy as np
 
 from core import tasks
 from core.models import Model, DataPrediction, Data, DataUncertainty, ProjectPermissions
 from core.utils.utils_annotate import label_data, assign_datum, get_assignments, batch_unassign
 from core.utils.utils_queue import fill_queue
+from core.utils.utils_model import (load_tfidf_matrix, load_tfidf_vectorizer, get_tfidf_rows,
+                                    load_tfidf_meta, get_corpus_fingerprint, train_and_save_model)
 from core.utils.utils_redis import get_ordered_data, redis_serialize_queue
 from core.utils.util import create_profile
 
@@ -65,6 +68,24 @@ def test_model_task(test_project_labeled_and_tfidf, test_queue_labeled, test_irr
     assert project.get_current_training_set().set_number == initial_training_set.set_number + 1
 
 
+def test_cv_metrics_task(test_project_labeled_and_tfidf, tmpdir, settings):
+    project = test_project_labeled_and_tfidf
+    model_path_temp = tmpdir.listdir()[0].mkdir('model_pickles')
+    settings.MODEL_PICKLE_PATH = str(model_path_temp)
+
+    model = train_and_save_model(project)
+    assert model.cv_accuracy is None
+    assert model.cv_metrics is None
+
+    tasks.send_cv_metrics_task.delay(model.pk).get()
+
+    model.refresh_from_db()
+    assert 0 <= model.cv_accuracy <= 1
+    labels = set(str(label.pk) for label in project.labels.all())
+    for metric in ('precision', 'recall', 'f1'):
+        assert set(model.cv_metrics[metric]) == labels
+
+
 def test_tfidf_creation_task(test_project_data, tmpdir, settings):
     data_temp = tmpdir.mkdir('data').mkdir('tf_idf')
     settings.TF_IDF_PATH = str(data_temp)
@@ -74,9 +95,50 @@ def test_tfidf_creation_task(test_project_data, tmpdir, settings):
 
     file = tasks.send_tfidf_creation_task.delay(project.pk).get()
 
-    assert os.path.isfile(file)
+    assert os.path.isdir(file)
     assert file == os.path.join(str(data_temp), 'project_'
-                                + str(test_project_data.pk) + '_tfidf_matrix.pkl')
+                                + str(test_project_data.pk) + '_tfidf_matrix')
+
+
+def test_tfidf_creation_task_fingerprint(test_project_data, tmpdir, settings):
+    data_temp = tmpdir.mkdir('data').mkdir('tf_idf')
+    settings.TF_IDF_PATH = str(data_temp)
+    project = test_project_data
+
+    file = tasks.send_tfidf_creation_task.delay(project.pk).get()
+    version = os.path.realpath(file)
+    assert load_tfidf_meta(project.pk)['fingerprint'] == get_corpus_fingerprint(project.pk, 'tfidf')
+
+    # Same data and settings, the matrix is not rebuilt
+    tasks.send_tfidf_creation_task.delay(project.pk).get()
+    assert os.path.realpath(file) == version
+
+    # Changed settings give a new matrix
+    settings.TFIDF_MIN_DF = 0.01
+    tasks.send_tfidf_creation_task.delay(project.pk).get()
+    assert os.path.realpath(file) != version
+
+
+def test_tfidf_creation_task_hashing(test_project_data, tmpdir, settings):
+    data_temp = tmpdir.mkdir('data').mkdir('tf_idf')
+    settings.TF_IDF_PATH = str(data_temp)
+    settings.HASHING_N_FEATURES = 2 ** 10
+
+    project = test_project_data
+    project.featurizer = 'hashing'
+    project.save()
+
+    tasks.send_tfidf_creation_task.delay(project.pk).get()
+
+    tf_idf = load_tfidf_matrix(project.pk)
+    assert tf_idf['meta']['featurizer'] == 'hashing'
+    assert tf_idf['matrix'].shape == (Data.objects.filter(project=project).count(), 2 ** 10)
+
+    # The saved vectorizer gives the same features the model is trained on
+    vectorizer = load_tfidf_vectorizer(project.pk)
+    datum = Data.objects.filter(project=project).first()
+    assert np.allclose(vectorizer.transform([datum.text]).toarray(),
+                       get_tfidf_rows(tf_idf, [datum.pk]).toarray())
 
 
 def test_model_task_redis_no_dupes_data_left_in_queue(test_project_labeled_and_tfidf, test_queue_labeled, test_irr_queue_labeled, test_admin_queue_labeled, test_redis, tmpdir, settings):